@@ -0,0 +1,60 @@
+"""
+Measure how long `django.setup()` takes in a fresh interpreter.
+
+    python benchmarks/bench_startup.py --runs 10 --max-ms 800
+
+Exits with status 1 if the median exceeds --max-ms, or if setup imported
+firebase_admin (which should only load on first use).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import json, os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'canteen_project.settings')
+start = time.perf_counter()
+import django
+django.setup()
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({'ms': elapsed, 'firebase_admin': 'firebase_admin' in sys.modules}))
+"""
+
+
+def measure():
+    out = subprocess.run(
+        [sys.executable, '-c', SNIPPET], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help="Fail if the median startup time is above this.")
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    timings = [r['ms'] for r in results]
+    median = statistics.median(timings)
+    print(f"django.setup(): median {median:.1f} ms, min {min(timings):.1f} ms, "
+          f"max {max(timings):.1f} ms over {args.runs} runs")
+
+    failed = False
+    if any(r['firebase_admin'] for r in results):
+        print("FAIL: firebase_admin was imported during startup")
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: median above {args.max_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Checkout latency and Firebase sync throughput against the local emulator.
+
+    python benchmarks/bench_sync.py --checkouts 20 --orders 300
+
+Runs three scenarios (Firebase answering in 0 ms, in 200 ms, and failing
+every request) on a throwaway test database. Checkout latency should not
+move with Firebase latency; throughput is outbox rows delivered per second
+by the worker's drain loop.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'canteen_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases  # noqa: E402
+from django.urls import resolve, reverse  # noqa: E402
+
+from orders import outbox  # noqa: E402
+from orders.firebase_client import reset_client  # noqa: E402
+from orders.firebase_emulator import FirebaseEmulator  # noqa: E402
+from orders.models import FirebaseOutbox, Item, Order, OrderItem  # noqa: E402
+from orders.ordering import new_idempotency_key  # noqa: E402
+
+SCENARIOS = [
+    ("0 ms", 0, 0.0),
+    ("200 ms", 200, 0.0),
+    ("failing", 0, 1.0),
+]
+
+
+def firebase_settings(url, dispatch):
+    return dict(settings.FIREBASE, DATABASE_URL=url, DISPATCH=dispatch,
+                MAX_RETRIES=1, BREAKER_RESET_TIMEOUT=60.0)
+
+
+def bench_checkout(url, items, runs):
+    with override_settings(FIREBASE=firebase_settings(url, 'thread')):
+        reset_client()
+        client = Client()
+        client.force_login(User.objects.get(username='bench'))
+        timings = []
+        for _ in range(runs):
+            # Filled the way the menu does it, so it lands in whichever cart store is configured.
+            response = client.post(reverse('orders:cart-update'), {'add': {item.pk: 1 for item in items}},
+                                   content_type='application/json')
+            assert response.json()['cart_quantity'] == len(items), response.content
+            start = time.perf_counter()
+            response = client.post(reverse('orders:checkout'), {
+                'full_name': 'Bench', 'phone': '0780000000', 'address': 'Kitchen',
+                'idempotency_key': new_idempotency_key(),
+            })
+            timings.append((time.perf_counter() - start) * 1000)
+            # An empty cart redirects too (to the menu), so check where to.
+            assert response.status_code == 302, response.status_code
+            assert resolve(response.url).url_name == 'order-success', response.url
+        return timings
+
+
+def bench_drain(url, items, orders):
+    FirebaseOutbox.objects.all().delete()
+    with override_settings(FIREBASE=firebase_settings(url, 'worker')):
+        reset_client()
+        for i in range(orders):
+            order = Order.objects.create(full_name=f"Bench {i}", phone="0", address="-")
+            for item in items[:3]:
+                OrderItem.objects.create(order=order, item=item, quantity=1, price=item.price)
+        queued = FirebaseOutbox.objects.count()
+
+        start = time.perf_counter()
+        sent = failed = 0
+        while outbox.pending_events().exists():
+            ok, bad = outbox.drain()
+            sent += ok
+            failed += bad
+            if bad:
+                break  # rows are rescheduled; the real worker would back off here
+        elapsed = time.perf_counter() - start
+        return queued, sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checkouts', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=300)
+    parser.add_argument('--cart-size', type=int, default=10)
+    args = parser.parse_args()
+
+    # A file database, so the background dispatch thread can write alongside us.
+    tmp = tempfile.TemporaryDirectory()
+    connection.settings_dict['TEST']['NAME'] = os.path.join(tmp.name, 'bench.sqlite3')
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        User.objects.create_user('bench', 'bench@example.com', 'bench')
+        with override_settings(FIREBASE=firebase_settings('http://127.0.0.1:9/', 'worker')):
+            items = [Item.objects.create(name=f"Item {i}", price=100 + i) for i in range(args.cart_size)]
+
+        print(f"{'scenario':<10} {'checkout p50':>13} {'checkout p95':>13} {'rows':>6} "
+              f"{'sent':>6} {'rows/s':>9} {'requests':>9}")
+        for name, latency, error_rate in SCENARIOS:
+            server = FirebaseEmulator(latency=latency, error_rate=error_rate).start()
+            try:
+                timings = sorted(bench_checkout(server.url, items, args.checkouts))
+                queued, sent, elapsed = bench_drain(server.url, items, args.orders)
+            finally:
+                server.shutdown()
+                server.server_close()
+            p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+            print(f"{name:<10} {statistics.median(timings):>10.1f} ms {p95:>10.1f} ms "
+                  f"{queued:>6} {sent:>6} {sent / elapsed if elapsed else 0:>9.0f} "
+                  f"{sum(server.requests.values()):>9}")
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        reset_client()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,10 @@
 ASGI config for canteen_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server in production so the dashboards' live order
+feed streams (see LIVE_ORDERS in settings.py):
+
+    uvicorn canteen_project.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
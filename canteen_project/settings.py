@@ -42,6 +42,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'orders.cart_store.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,7 +59,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'orders.views.cart_count',
+                'orders.context_processors.cart_summary',
             ],
         },
     },
@@ -74,6 +75,81 @@ DATABASES = {
     }
 }
 
+# Cache
+# Local memory works for a single process. With several workers the catalog
+# version must be shared, so set REDIS_URL (e.g. redis://127.0.0.1:6379/1).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'carts',
+            'TIMEOUT': None,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'canteen',
+        },
+        # For CART['STORE'] = 'cache': carts must not be evicted with catalog
+        # pages. Local memory is per process and lost on restart.
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'canteen-carts',
+            'TIMEOUT': None,
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Cart storage (orders/cart_store.py): 'redis' (one hash per cart, atomic
+# adds across processes), 'cache' (CACHES['carts'], single process only),
+# 'cookie' (signed cookie, no server state) or 'session' (old behaviour,
+# the default without REDIS_URL: carts must survive restarts and be shared
+# by every worker)
+CART = {
+    'STORE': os.getenv('CART_STORE', 'redis' if os.getenv('REDIS_URL') else 'session'),
+    'CACHE': 'carts',
+    'REDIS_URL': os.getenv('REDIS_URL'),
+    'TIMEOUT': 14 * 24 * 3600,
+}
+
+# Live order feed for the dashboards (orders/live.py): 'local' (in-process,
+# single server process only) or 'redis' (pub/sub shared by all processes).
+# The feed only runs under an ASGI server, where each open dashboard costs a
+# coroutine rather than a worker thread; in production run
+#     uvicorn canteen_project.asgi:application --workers 4
+# (pip install uvicorn; use the 'redis' backend with more than one worker).
+# Under WSGI (runserver, gunicorn) the dashboards fall back to plain reloads.
+LIVE_ORDERS = {
+    'BACKEND': os.getenv('LIVE_ORDERS_BACKEND', 'redis' if os.getenv('REDIS_URL') else 'local'),
+    'REDIS_URL': os.getenv('REDIS_URL'),
+    'CHANNEL': 'orders:live',
+    'KEEPALIVE': 15,  # seconds between keep-alive comments on an idle stream
+    'QUEUE_SIZE': 100,  # events buffered per slow subscriber before dropping
+    'RETRY_MS': 3000,  # browser reconnect delay after a dropped stream
+}
+
+# Seconds a cached menu/category page stays valid (entries are also keyed on
+# a catalog version, bumped whenever an Item or Category changes)
+CATALOG_CACHE_TIMEOUT = 600
+# Days deleted-item tombstones are kept for menu API delta clients (?since=);
+# clients that last synced earlier get a full catalog instead
+CATALOG_TOMBSTONE_DAYS = 30
+
+# List pages (menu, orders, dashboards) use keyset pagination; ?page_size=
+# overrides the default up to MAX_PAGE_SIZE
+PAGINATION = {
+    'PAGE_SIZE': 24,
+    'MAX_PAGE_SIZE': 100,
+    'SEARCH_RESULTS': 48,  # ranked search results are not paginated
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
@@ -94,6 +170,13 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized copies of item images (orders/images.py), used for srcset
+IMAGE_VARIANTS = {
+    'WIDTHS': [120, 320, 640],
+    'FORMATS': ['webp', 'jpeg'],
+    'QUALITY': 80,
+}
+
 # Auth redirects
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -131,3 +214,34 @@ MTN_MOMO = {
     'TARGET_ENV': os.getenv('MTN_MOMO_TARGET_ENV', 'sandbox'),
     'BASE_URL': os.getenv('MTN_MOMO_BASE_URL', 'https://sandbox.momodeveloper.mtn.com'),
 }
+
+# ---------------------------
+# Firebase Realtime Database sync
+# ---------------------------
+# DISPATCH: 'thread' sends each committed batch from a background thread,
+# 'inline' sends it right after commit, 'worker' leaves everything to
+# `manage.py process_firebase_outbox`.
+FIREBASE = {
+    # Point at `manage.py firebase_emulator` (e.g. http://127.0.0.1:9000/) for local testing
+    'DATABASE_URL': os.getenv('FIREBASE_DATABASE_URL', 'https://canteen-app-61545-default-rtdb.firebaseio.com/'),
+    # Admin SDK (orders/firebase.py) is initialised lazily, and only if enabled
+    'ADMIN_SDK_ENABLED': os.getenv('FIREBASE_ADMIN_SDK_ENABLED', '') == '1',
+    'CREDENTIALS_FILE': os.getenv(
+        'FIREBASE_CREDENTIALS_FILE',
+        str(BASE_DIR / 'canteen_project' / 'canteen-app-61545-firebase-adminsdk-fbsvc-696f45b0d2.json'),
+    ),
+    'DISPATCH': os.getenv('FIREBASE_DISPATCH', 'thread'),
+    'DISPATCH_THREADS': int(os.getenv('FIREBASE_DISPATCH_THREADS', '2')),
+    # HTTP client: pooled keep-alive session, timeouts in seconds
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.0,
+    'READ_TIMEOUT': 10.0,
+    # Retries are jittered and limited to ~20% of successful traffic
+    'MAX_RETRIES': 2,
+    'RETRY_BUDGET_RATIO': 0.2,
+    # Fail fast for 30s after 5 consecutive failures
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET_TIMEOUT': 30.0,
+    # Delivered outbox rows are deleted after this many days
+    'OUTBOX_RETENTION_DAYS': 7,
+}
@@ -1,7 +1,6 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from orders import views as order_views  # import your custom admin dashboard views
 
 urlpatterns = [
@@ -17,6 +16,8 @@ urlpatterns = [
     path('', include('orders.urls')),
 ]
 
-# Serve uploaded images during development
+# Serve uploaded images during development (content-addressed ones as immutable)
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), order_views.serve_media),
+    ]
@@ -1,6 +1,6 @@
 # orders/admin.py
 from django.contrib import admin
-from .models import Category, Item, Order, OrderItem
+from .models import Category, Item, Order, OrderItem, FirebaseOutbox
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -19,11 +19,18 @@ class OrderAdmin(admin.ModelAdmin):
         "created_at",
         "status",
         "total_price",
+        "line_count",
+        "item_count",
         "items_summary",
     )
     list_filter = ("status", "created_at")
     search_fields = ("full_name", "phone", "address", "user__username")
     inlines = [OrderItemInline]
+    readonly_fields = ("total_price", "item_count", "line_count")
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.calculate_total()
 
     def items_summary(self, obj):
         items = obj.items.select_related("item").all()
@@ -37,3 +44,11 @@ class OrderAdmin(admin.ModelAdmin):
 admin.site.register(Category)
 admin.site.register(Item)
 
+
+@admin.register(FirebaseOutbox)
+class FirebaseOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "batch", "path", "attempts", "created_at", "next_attempt_at", "sent_at", "rejected_at")
+    list_filter = ("sent_at", "rejected_at")
+    search_fields = ("path",)
+    readonly_fields = ("created_at",)
+
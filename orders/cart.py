@@ -0,0 +1,115 @@
+"""
+Cart resolution: turn the stored cart ({item_id: quantity}, see
+cart_store.py) into priced lines with one query, however many lines the
+cart has; and batched cart changes that respect stock.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from .models import Item
+
+
+@dataclass
+class CartLine:
+    item: Item
+    quantity: int
+
+    @property
+    def subtotal(self):
+        return self.item.price * self.quantity
+
+
+@dataclass
+class ResolvedCart:
+    lines: list = field(default_factory=list)
+    # Cart keys whose item no longer exists (or were never valid ids)
+    stale: list = field(default_factory=list)
+
+    @property
+    def total(self):
+        return sum((line.subtotal for line in self.lines), Decimal('0'))
+
+    @property
+    def quantity(self):
+        return sum(line.quantity for line in self.lines)
+
+    def summary(self):
+        """JSON-ready cart totals, returned by the cart update endpoint."""
+        return {
+            'cart_quantity': self.quantity,
+            'total': str(self.total),
+            'lines': {
+                str(line.item.pk): {'quantity': line.quantity, 'subtotal': str(line.subtotal)}
+                for line in self.lines
+            },
+        }
+
+    def stock_lines(self):
+        """(Item, quantity) pairs, as stock.reserve() takes them."""
+        return [(line.item, line.quantity) for line in self.lines]
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+def resolve_cart(cart):
+    """Fetch every item in `cart` in a single query; unknown ids become `stale`."""
+    ids = {}
+    resolved = ResolvedCart()
+    for key, qty in cart.items():
+        try:
+            ids[key] = int(key)
+        except (TypeError, ValueError):
+            resolved.stale.append(key)
+
+    items = Item.objects.select_related('category').in_bulk(ids.values())
+    for key, pk in ids.items():
+        if pk in items:
+            resolved.lines.append(CartLine(items[pk], cart[key]))
+        else:
+            resolved.stale.append(key)
+    return resolved
+
+
+def apply_cart_changes(store, add=None, set=None, remove=()):
+    """
+    Apply a batch of cart changes: `add` increments lines, `set` replaces
+    quantities (0 removes), `remove` drops lines. All items are fetched in
+    one query. Lines that would exceed stock or are sold out are left as
+    they were; returns {item_id: error message} for them.
+    """
+    add = {str(pk): qty for pk, qty in (add or {}).items()}
+    set = {str(pk): qty for pk, qty in (set or {}).items()}
+    items = Item.objects.in_bulk({int(pk) for pk in [*add, *set]})
+    errors = {}
+
+    for pk, quantity in {**add, **set}.items():
+        item = items.get(int(pk))
+        if item is None:
+            store.remove(pk)
+            errors[pk] = "This item is no longer on the menu."
+            continue
+        left = item.stock if item.available else 0
+        if pk in set:
+            if left is None or quantity <= left:
+                store.set(pk, quantity, price=item.price)
+                continue
+        elif left is None:
+            store.add(pk, quantity, price=item.price)
+            continue
+        elif left != 0:
+            # Increment first (one atomic step), then undo if it overshot.
+            if store.add(pk, quantity, price=item.price) <= left:
+                continue
+            store.add(pk, -quantity)
+        errors[pk] = f"Sorry, only {left} {item.name} left." if left else f"Sorry, {item.name} is sold out."
+
+    for pk in remove:
+        store.remove(pk)
+    return errors
@@ -0,0 +1,324 @@
+"""
+Where carts live. Views talk to `request.cart` (set by CartMiddleware)
+instead of the session, so adding to the cart doesn't rewrite the session
+row on every click.
+
+settings.CART['STORE'] picks the backend:
+
+- 'redis'   one Redis hash per cart (CART['REDIS_URL']); every change is
+            one atomic round trip, shared by all processes. The default
+            when REDIS_URL is set.
+- 'cache'   the cart is one entry in the CART['CACHE'] cache alias; atomic
+            within one process only, so only for a single server process.
+- 'cookie'  the cart is a signed cookie; no server state, but concurrent
+            adds from one browser can overwrite each other.
+- 'session' the old behaviour; the default without Redis, since it is
+            shared by every process and survives restarts.
+
+Every store can give a CartSummary (lines, quantity, total) without the
+database: the Redis store keeps it as counters that each change updates,
+the others work it out from the one cart entry they load anyway.
+The total uses the price passed in when a line last changed; the cart page
+and checkout re-price from the database (orders/cart.py).
+
+Carts belong to the logged-in user (every cart view requires login);
+anonymous visitors always see an empty cart.
+"""
+import threading
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+
+def _config():
+    return getattr(settings, 'CART', {})
+
+
+def _cents(price):
+    return int(Decimal(price) * 100)
+
+
+@dataclass
+class CartSummary:
+    lines: int = 0
+    quantity: int = 0
+    total: Decimal = Decimal('0')
+
+
+class CartStore:
+    """Cart lines as {item_id (str): quantity}."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def owner(self):
+        user = getattr(self.request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def get(self):
+        raise NotImplementedError
+
+    def add(self, item_id, quantity=1, price=None):
+        """Add `quantity` (negative to undo) to one line and return its new quantity."""
+        raise NotImplementedError
+
+    def set(self, item_id, quantity, price=None):
+        raise NotImplementedError
+
+    def remove(self, item_id):
+        self.set(item_id, 0)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def summary(self):
+        raise NotImplementedError
+
+    def count(self):
+        return self.summary().quantity
+
+    def save(self, response):
+        """Called by CartMiddleware with the outgoing response."""
+
+
+class DictCartStore(CartStore):
+    """
+    A store that loads the whole cart at once: lines plus the unit price
+    (in cents) of each, so the summary is worked out in memory.
+    """
+
+    def _load(self):
+        """Return (lines, prices)."""
+        raise NotImplementedError
+
+    def _store(self, lines, prices):
+        raise NotImplementedError
+
+    def get(self):
+        if self.owner is None:
+            return {}
+        return {k: v for k, v in self._load()[0].items() if v > 0}
+
+    def add(self, item_id, quantity=1, price=None):
+        lines, _ = self._load()
+        new = lines.get(str(item_id), 0) + quantity
+        self.set(item_id, new, price)
+        return new
+
+    def set(self, item_id, quantity, price=None):
+        lines, prices = (dict(part) for part in self._load())
+        key = str(item_id)
+        if quantity > 0:
+            lines[key] = quantity
+            if price is not None:
+                prices[key] = _cents(price)
+        else:
+            lines.pop(key, None)
+            prices.pop(key, None)
+        self._store(lines, prices)
+
+    def clear(self):
+        self._store({}, {})
+
+    def summary(self):
+        lines = self.get()
+        prices = self._load()[1] if lines else {}
+        cents = sum(qty * prices.get(key, 0) for key, qty in lines.items())
+        return CartSummary(len(lines), sum(lines.values()), Decimal(cents) / 100)
+
+
+class SessionCartStore(DictCartStore):
+    def _load(self):
+        session = self.request.session
+        return session.get('cart', {}), session.get('cart_prices', {})
+
+    def _store(self, lines, prices):
+        self.request.session['cart'] = lines
+        self.request.session['cart_prices'] = prices
+
+
+class CacheCartStore(DictCartStore):
+    """
+    The whole cart is one entry in the CART['CACHE'] cache, so it has one
+    expiry, renewed by every write. Writes are read-modify-write under a
+    process-wide lock: atomic on a local-memory cache, which is per process
+    anyway, but not between processes sharing a file-based cache.
+    """
+    _lock = threading.RLock()  # add() calls set()
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.cache = caches[_config().get('CACHE', 'default')]
+        self.timeout = _config().get('TIMEOUT', 14 * 24 * 3600)
+
+    def _key(self):
+        return f'cart:{self.owner}'
+
+    def _load(self):
+        return self.cache.get(self._key(), ({}, {}))
+
+    def _store(self, lines, prices):
+        if lines:
+            self.cache.set(self._key(), (lines, prices), self.timeout)
+        else:
+            self.cache.delete(self._key())
+
+    def add(self, item_id, quantity=1, price=None):
+        with self._lock:
+            return super().add(item_id, quantity, price)
+
+    def set(self, item_id, quantity, price=None):
+        with self._lock:
+            super().set(item_id, quantity, price)
+
+
+# One script run per change: atomic across processes, and the hash's expiry
+# is renewed in the same step. KEYS[1] is the cart; ARGV is the item id,
+# 'add' or 'set', the quantity, the unit price in cents ('' keeps the stored
+# one) and the timeout.
+REDIS_CHANGE_SCRIPT = """
+local line, price = 'line:' .. ARGV[1], 'price:' .. ARGV[1]
+local old = tonumber(redis.call('HGET', KEYS[1], line)) or 0
+local old_unit = tonumber(redis.call('HGET', KEYS[1], price)) or 0
+local new = tonumber(ARGV[3])
+if ARGV[2] == 'add' then new = old + new end
+if old <= 0 and new <= 0 then return 0 end
+local unit = tonumber(ARGV[4]) or old_unit
+if new > 0 then
+    redis.call('HSET', KEYS[1], line, new, price, unit)
+else
+    new, unit = 0, 0
+    redis.call('HDEL', KEYS[1], line, price)
+end
+redis.call('HINCRBY', KEYS[1], 'lines', (new > 0 and 1 or 0) - (old > 0 and 1 or 0))
+redis.call('HINCRBY', KEYS[1], 'quantity', new - old)
+redis.call('HINCRBY', KEYS[1], 'cents', new * unit - old * old_unit)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return new
+"""
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def _redis_client():
+    """Shared client and change script, so requests reuse one connection pool."""
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            import redis
+
+            client = redis.Redis.from_url(_config()['REDIS_URL'])
+            _redis = client, client.register_script(REDIS_CHANGE_SCRIPT)
+        return _redis
+
+
+class RedisCartStore(CartStore):
+    """
+    The cart is one Redis hash: a 'line:<id>' quantity and 'price:<id>'
+    unit price (in cents) per line, plus the summary counters. Every change
+    is one round trip (REDIS_CHANGE_SCRIPT); the badge reads three fields.
+    """
+    SUMMARY = ('lines', 'quantity', 'cents')
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.client, self.change = _redis_client()
+        self.timeout = _config().get('TIMEOUT', 14 * 24 * 3600)
+
+    def _key(self):
+        return f'cart:{self.owner}'
+
+    def _change(self, item_id, op, quantity, price):
+        args = [item_id, op, quantity, '' if price is None else _cents(price), self.timeout]
+        return int(self.change(keys=[self._key()], args=args))
+
+    def get(self):
+        if self.owner is None:
+            return {}
+        fields = {k.decode(): int(v) for k, v in self.client.hgetall(self._key()).items()}
+        return {k[len('line:'):]: v for k, v in fields.items() if k.startswith('line:') and v > 0}
+
+    def add(self, item_id, quantity=1, price=None):
+        return self._change(item_id, 'add', quantity, price)
+
+    def set(self, item_id, quantity, price=None):
+        self._change(item_id, 'set', quantity, price)
+
+    def clear(self):
+        self.client.delete(self._key())
+
+    def summary(self):
+        if self.owner is None:
+            return CartSummary()
+        lines, quantity, cents = (int(v or 0) for v in self.client.hmget(self._key(), self.SUMMARY))
+        return CartSummary(lines, quantity, Decimal(cents) / 100)
+
+
+class SignedCookieCartStore(DictCartStore):
+    cookie_name = 'cart'
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._cart = None
+        self._dirty = False
+
+    @property
+    def salt(self):
+        # Per user, so a cart cookie left on a shared kiosk is useless to the next login.
+        return f'orders.cart:{self.owner}'
+
+    def _load(self):
+        if self._cart is None:
+            try:
+                self._cart = signing.loads(
+                    self.request.COOKIES.get(self.cookie_name, ''), salt=self.salt,
+                    max_age=_config().get('TIMEOUT'),
+                )
+            except signing.BadSignature:
+                self._cart = {}
+        return self._cart.get('lines', {}), self._cart.get('prices', {})
+
+    def _store(self, lines, prices):
+        self._cart, self._dirty = {'lines': lines, 'prices': prices}, True
+
+    def save(self, response):
+        if not self._dirty:
+            return
+        if self._cart['lines']:
+            response.set_cookie(
+                self.cookie_name, signing.dumps(self._cart, salt=self.salt, compress=True),
+                max_age=_config().get('TIMEOUT'), httponly=True, samesite='Lax',
+                secure=self.request.is_secure(),
+            )
+        else:
+            response.delete_cookie(self.cookie_name)
+
+
+STORES = {
+    'cache': CacheCartStore,
+    'cookie': SignedCookieCartStore,
+    'redis': RedisCartStore,
+    'session': SessionCartStore,
+}
+
+
+def get_cart_store(request):
+    return STORES[_config().get('STORE', 'session')](request)
+
+
+class CartMiddleware:
+    """Puts the configured store on `request.cart`; list it after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = get_cart_store(request)
+        response = self.get_response(request)
+        request.cart.save(response)
+        return response
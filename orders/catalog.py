@@ -0,0 +1,162 @@
+"""
+Versioned cache for the public catalog (menu and category pages).
+
+Every cache key includes a catalog version number that Item/Category save
+and delete signals bump, so stale entries are never read again and simply
+age out; nothing has to be deleted explicitly.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+VERSION_KEY = 'catalog:version'
+
+# Deltas re-send changes this close to the client's `since`, so a save whose
+# transaction committed after a newer one was read is not missed.
+SYNC_OVERLAP = timedelta(seconds=10)
+
+
+def catalog_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600)
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost counter never reuses an old version.
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        catalog_version()
+        return cache.incr(VERSION_KEY)
+
+
+def catalog_context():
+    """Template variables used to key cached catalog fragments."""
+    return {'catalog_version': catalog_version(), 'catalog_timeout': catalog_timeout()}
+
+
+def _cached(name, build, *parts):
+    # Hash the variable parts: search text may contain characters some cache backends reject.
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    key = f"catalog:{catalog_version()}:{name}:{digest}"
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, catalog_timeout())
+    return value
+
+
+def get_categories():
+    from .models import Category
+    return _cached('categories', lambda: list(Category.objects.all()))
+
+
+def get_menu_page(query='', category_id=None, cursor=None, page_size=None):
+    """
+    One page of menu items (a KeysetPage), optionally filtered by category.
+    Search results come back best match first, capped at
+    PAGINATION['SEARCH_RESULTS'] instead of being paginated.
+    """
+    from django.db.models import Q
+    from .models import Item
+    from .pagination import KeysetPage, keyset_paginate
+    from .search import search_item_ids
+
+    def build():
+        items = Item.objects.filter(available=True).select_related('category')
+        if category_id is not None:
+            items = items.filter(category_id=category_id)
+        if not query:
+            return keyset_paginate(items, cursor, page_size)
+
+        # Filtered inside the search, so unavailable matches don't use up the limit
+        ids = search_item_ids(query, limit=settings.PAGINATION['SEARCH_RESULTS'],
+                              available=True, category_id=category_id)
+        if ids is None:  # no full-text index on this database
+            items = items.filter(Q(name__icontains=query) | Q(description__icontains=query))
+            return keyset_paginate(items, cursor, page_size)
+        by_id = items.in_bulk(ids)
+        return KeysetPage([by_id[pk] for pk in ids if pk in by_id])  # best match first
+
+    return _cached('items', build, category_id or '', query, cursor or '', page_size or '')
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'CATALOG_TOMBSTONE_DAYS', 30))
+
+
+def encode_sync_version(when):
+    return str(int(when.timestamp() * 1_000_000)) if when else '0'
+
+
+def decode_sync_version(value):
+    """Parse a `since` token from the menu API; raises ValueError if malformed."""
+    try:
+        return datetime.fromtimestamp(int(value) / 1_000_000, tz=dt_timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError(value) from e
+
+
+def needs_full_sync(since):
+    # Older than the tombstones we keep: deletions may be missing, start over.
+    return since is None or since < timezone.now() - tombstone_retention()
+
+
+def menu_snapshot(since=None):
+    """
+    The catalog as plain data for the JSON menu API. With `since` (from a
+    previous response's "version") only items changed or deleted after it
+    are listed; categories are always sent in full, there are only a few.
+    """
+    from .models import Category, Item, ItemTombstone
+    full = needs_full_sync(since)
+
+    def build():
+        items = Item.objects.order_by('id')
+        tombstones = ItemTombstone.objects.all()
+        if not full:
+            horizon = since - SYNC_OVERLAP
+            items = items.filter(updated_at__gt=horizon)
+            tombstones = tombstones.filter(deleted_at__gt=horizon)
+
+        latest = [
+            Item.objects.aggregate(v=Max('updated_at'))['v'],
+            ItemTombstone.objects.aggregate(v=Max('deleted_at'))['v'],
+        ]
+        storage = Item._meta.get_field('image').storage
+        return {
+            'version': encode_sync_version(max(filter(None, latest), default=None)),
+            'full': full,
+            'categories': list(Category.objects.values('id', 'name')),
+            'items': [
+                {
+                    'id': row['id'],
+                    'name': row['name'],
+                    'price': row['price'],
+                    'available': row['available'],
+                    'category': row['category_id'],
+                    'image': storage.url(row['image']) if row['image'] else None,
+                    'images': {
+                        fmt: {width: storage.url(name) for width, name in names.items()}
+                        for fmt, names in row['image_variants'].items() if isinstance(names, dict)
+                    },
+                }
+                for row in items.values('id', 'name', 'price', 'available', 'category_id',
+                                        'image', 'image_variants')
+            ],
+            'deleted': [] if full else sorted(set(tombstones.values_list('item_id', flat=True))),
+        }
+
+    return _cached('menu_snapshot', build, None if full else since)
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart_store import get_cart_store
+
+
+def cart_summary(request):
+    """
+    The cart badge's CartSummary, read only if a template actually uses
+    it, so pages without the badge (dashboard, static files) never touch
+    the cart store.
+    """
+    def load():
+        store = getattr(request, 'cart', None) or get_cart_store(request)
+        return store.summary()
+    return {'cart_summary': SimpleLazyObject(load)}
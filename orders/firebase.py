@@ -1,16 +1,43 @@
-import os
-import firebase_admin
-from firebase_admin import credentials, db
-
-# Full path ya JSON key yawe
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-JSON_PATH = os.path.join(BASE_DIR, "canteen_project", "canteen-app-61545-firebase-adminsdk-fbsvc-696f45b0d2.json")
-
-# Initialize Firebase
-cred = credentials.Certificate(JSON_PATH)
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://canteen-app-61545-default-rtdb.firebaseio.com/'
-})
-
-# Reference to root
-firebase_db = db.reference('/')
+"""
+Firebase Admin SDK access, initialised lazily.
+
+Nothing is read or initialised at import time, so manage.py commands, tests
+and workers start without the service-account file. The SDK is only used
+when settings.FIREBASE['ADMIN_SDK_ENABLED'] is on; REST writes go through
+orders.firebase_client instead.
+"""
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+_db = None
+_lock = threading.Lock()
+
+
+def get_firebase_db():
+    """Reference to the database root, initialising the Admin SDK on first use."""
+    global _db
+    if _db is not None:
+        return _db
+
+    config = settings.FIREBASE
+    if not config.get('ADMIN_SDK_ENABLED'):
+        raise ImproperlyConfigured("Firebase Admin SDK is disabled (FIREBASE['ADMIN_SDK_ENABLED']).")
+
+    with _lock:
+        if _db is None:
+            import firebase_admin
+            from firebase_admin import credentials, db
+
+            cred = credentials.Certificate(config['CREDENTIALS_FILE'])
+            firebase_admin.initialize_app(cred, {'databaseURL': config['DATABASE_URL']})
+            _db = db.reference('/')
+    return _db
+
+
+def __getattr__(name):
+    # Keep `from orders.firebase import firebase_db` working, lazily.
+    if name == 'firebase_db':
+        return get_firebase_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,217 @@
+"""
+Shared HTTP client for the Firebase Realtime Database REST API.
+
+One pooled keep-alive session per process, strict connect/read timeouts,
+jittered retries limited by a retry budget, and a circuit breaker that fails
+fast while Firebase is down. Callers that get `FirebaseUnavailable` should
+defer the write (the outbox does this) rather than block.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FirebaseError(Exception):
+    """A Firebase request failed."""
+
+
+class FirebaseRejected(FirebaseError):
+    """Firebase refused the request (4xx); sending it again won't help."""
+
+
+class FirebaseUnavailable(FirebaseError):
+    """The circuit breaker is open; the request was not attempted."""
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RetryBudget:
+    """
+    Token bucket that caps retries to a fraction of normal traffic, so a
+    Firebase outage can't multiply our request volume.
+    """
+
+    def __init__(self, ratio=0.2, minimum=10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.minimum + 100 * self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, retries after `reset_timeout`."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial request through."""
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == self.HALF_OPEN:
+                # Let one trial through; push the window out for everyone else.
+                self.opened_at = time.monotonic()
+                return True
+            return state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Firebase circuit opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+class FirebaseClient:
+    def __init__(self, base_url, connect_timeout=3.0, read_timeout=10.0,
+                 max_retries=2, backoff=0.2, pool_size=10, retry_budget=None, breaker=None):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._counters = dict.fromkeys(
+            ['requests', 'successes', 'failures', 'retries', 'retries_denied', 'short_circuited'], 0
+        )
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        finished = stats['successes'] + stats['failures']
+        stats['error_rate'] = round(stats['failures'] / finished, 4) if finished else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def request(self, method, path, data=None, params=None):
+        """Send one request to `<base_url><path>.json` and return the decoded body."""
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            retry_after = self.breaker.retry_after()
+            raise FirebaseUnavailable(
+                f"Firebase circuit open, retry in {retry_after:.0f}s", retry_after=retry_after
+            )
+
+        url = f"{self.base_url}{path}.json"
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                response = self.session.request(
+                    method, url, json=data, params=params, timeout=self.timeout
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    self.budget.deposit()
+                    self.breaker.record_success()
+                    self._count('successes')
+                    return response.json()
+                error = FirebaseError(f"HTTP {response.status_code} from Firebase")
+            except requests.HTTPError as e:
+                # 4xx: our request is wrong, retrying won't help.
+                self._count('failures')
+                raise FirebaseRejected(str(e)) from e
+            except requests.RequestException as e:
+                error = FirebaseError(str(e))
+
+            if attempt >= self.max_retries or not self.budget.withdraw():
+                if attempt < self.max_retries:
+                    self._count('retries_denied')
+                self.breaker.record_failure()
+                self._count('failures')
+                raise error
+
+            attempt += 1
+            self._count('retries')
+            # Full jitter: sleep anywhere up to the exponential ceiling.
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def reset_client():
+    """Forget the shared client, e.g. after changing settings.FIREBASE."""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def get_client():
+    """Process-wide client built from settings.FIREBASE."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = settings.FIREBASE
+            _client = FirebaseClient(
+                config['DATABASE_URL'],
+                connect_timeout=config.get('CONNECT_TIMEOUT', 3.0),
+                read_timeout=config.get('READ_TIMEOUT', 10.0),
+                max_retries=config.get('MAX_RETRIES', 2),
+                pool_size=config.get('POOL_SIZE', 10),
+                retry_budget=RetryBudget(ratio=config.get('RETRY_BUDGET_RATIO', 0.2)),
+                breaker=CircuitBreaker(
+                    threshold=config.get('BREAKER_THRESHOLD', 5),
+                    reset_timeout=config.get('BREAKER_RESET_TIMEOUT', 30.0),
+                ),
+            )
+        return _client
@@ -0,0 +1,210 @@
+"""
+Small in-memory stand-in for the Firebase Realtime Database REST API.
+
+Supports GET/PUT/POST/PATCH/DELETE on `/<path>.json`, multi-path PATCH,
+`shallow=true` and `orderBy="$key"` with startAt/endAt/limitToFirst, which
+is everything this app uses. Latency and failures can be injected to
+load-test the sync path:
+
+    python manage.py firebase_emulator --port 9000 --latency 200
+    FIREBASE_DATABASE_URL=http://127.0.0.1:9000/ python manage.py runserver
+"""
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def push_id():
+    """Chronologically sortable key in the same format as Firebase push IDs."""
+    now = int(time.time() * 1000)
+    stamp = ""
+    for _ in range(8):
+        stamp = PUSH_CHARS[now % 64] + stamp
+        now //= 64
+    return stamp + "".join(secrets.choice(PUSH_CHARS) for _ in range(12))
+
+
+def _key_order(key):
+    # Firebase sorts integer keys numerically, before all string keys.
+    return (0, int(key), "") if key.lstrip("-").isdigit() else (1, 0, key)
+
+
+def _prune(value):
+    """Firebase stores neither nulls nor empty objects."""
+    if isinstance(value, dict):
+        value = {k: _prune(v) for k, v in value.items()}
+        value = {k: v for k, v in value.items() if v is not None}
+        return value or None
+    return value
+
+
+class Tree:
+    def __init__(self):
+        self.root = {}
+        self.lock = threading.Lock()
+
+    def get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def set(self, parts, value):
+        value = _prune(value)
+        if not parts:
+            self.root = value or {}
+            return
+        node = self.root
+        trail = []
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            trail.append((node, part))
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+            # Remove parents left empty by the delete.
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                del parent[part]
+        else:
+            node[parts[-1]] = value
+
+    def update(self, parts, mapping):
+        for path, value in mapping.items():
+            self.set(parts + [p for p in path.split("/") if p], value)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "FirebaseEmulator/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _parts(self):
+        path = urlparse(self.path).path
+        if path.endswith(".json"):
+            path = path[:-len(".json")]
+        return [p for p in path.split("/") if p]
+
+    def _query(self):
+        return {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        server = self.server
+        server.count(method)
+        if server.latency:
+            time.sleep(server.latency / 1000)
+        body = self._body() if method in ("PUT", "POST", "PATCH") else None
+        if server.error_rate and random.random() < server.error_rate:
+            server.count("errors")
+            return self._reply(503, {"error": "injected failure"})
+
+        parts = self._parts()
+        tree = server.tree
+        with tree.lock:
+            if method == "GET":
+                return self._reply(200, self._query_result(tree.get(parts)))
+            if method == "PUT":
+                tree.set(parts, body)
+                return self._reply(200, body)
+            if method == "POST":
+                key = push_id()
+                tree.set(parts + [key], body)
+                return self._reply(200, {"name": key})
+            if method == "PATCH":
+                if not isinstance(body, dict):
+                    return self._reply(400, {"error": "PATCH body must be an object"})
+                tree.update(parts, body)
+                return self._reply(200, body)
+            if method == "DELETE":
+                tree.set(parts, None)
+                return self._reply(200, None)
+
+    def _query_result(self, value):
+        query = self._query()
+        if not isinstance(value, dict):
+            return value
+        if query.get("shallow") == "true":
+            return {k: True for k in value}
+        if query.get("orderBy") == '"$key"':
+            keys = sorted(value, key=_key_order)
+            if "startAt" in query:
+                start = _key_order(str(json.loads(query["startAt"])))
+                keys = [k for k in keys if _key_order(k) >= start]
+            if "endAt" in query:
+                end = _key_order(str(json.loads(query["endAt"])))
+                keys = [k for k in keys if _key_order(k) <= end]
+            if "limitToFirst" in query:
+                keys = keys[:int(query["limitToFirst"])]
+            return {k: value[k] for k in keys}
+        return value
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class FirebaseEmulator(ThreadingHTTPServer):
+    """In-memory RTDB server. `latency` is in ms, `error_rate` in 0..1."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, error_rate=0.0, verbose=False):
+        super().__init__((host, port), Handler)
+        self.tree = Tree()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.requests = {}
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, name):
+        with self._count_lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def start(self):
+        """Serve from a daemon thread; returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -1,6 +1,18 @@
-import requests
+import logging
+
+from .firebase_client import FirebaseError, get_client
+
+logger = logging.getLogger(__name__)
+
+
+def push_to_firebase(path, data, method="POST"):
+    """
+    Write data to Firebase Realtime Database and return the decoded response.
+    Raises FirebaseError (FirebaseUnavailable while the circuit is open), so
+    callers such as the outbox can defer and retry.
+    """
+    return get_client().request(method, path, data)
 
-FIREBASE_URL = "https://canteen-app-61545-default-rtdb.firebaseio.com/"
 
 def send_to_firebase(path, data):
     """
@@ -8,9 +20,7 @@ def send_to_firebase(path, data):
     Example path: 'items', 'orders', 'payments'
     """
     try:
-        url = f"{FIREBASE_URL}{path}.json"
-        response = requests.post(url, json=data)
-        return response.json()
-    except Exception as e:
-        print("Firebase Error:", e)
+        return push_to_firebase(path, data)
+    except FirebaseError as e:
+        logger.warning("Firebase write to /%s failed: %s", path, e)
         return None
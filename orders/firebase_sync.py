@@ -0,0 +1,184 @@
+"""
+Per-transaction batching of Firebase writes.
+
+Every write recorded while a transaction is open is stored in the outbox
+under one batch id. When the transaction commits, the whole batch is sent
+as a single multi-path PATCH to the database root; if it rolls back, the
+outbox rows vanish with it and nothing is sent.
+
+Keyed entities (`sync_entity`) are also change-aware: the last payload
+queued for each path is remembered, so only changed fields are written and
+an unchanged save writes nothing at all.
+"""
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def current_batch():
+    """Batch id shared by every write until the current transaction commits."""
+    batch_id = getattr(_state, 'batch_id', None)
+    if batch_id is None:
+        batch_id = _state.batch_id = uuid.uuid4()
+    return batch_id
+
+
+def payload_digest(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def diff_payload(path, old, new):
+    """Multi-path update turning the `old` node at `path` into `new`."""
+    changes = {f"{path}/{key}": value for key, value in new.items() if old.get(key) != value}
+    for key in old.keys() - new.keys():
+        changes[f"{path}/{key}"] = None
+    return changes
+
+
+def sync_entity(path, data):
+    """
+    Queue `data` as the new value of the node at `path`, sending only fields
+    that differ from the last queued version. Returns the number of paths
+    queued (0 when nothing changed).
+    """
+    from .models import FirebaseSyncState
+
+    digest = payload_digest(data)
+    state = FirebaseSyncState.objects.filter(path=path).first()
+    if state is None:
+        changes = {path: data}
+        FirebaseSyncState.objects.create(path=path, digest=digest, payload=data)
+    elif state.digest == digest:
+        return 0
+    else:
+        changes = diff_payload(path, state.payload, data)
+        state.digest = digest
+        state.payload = data
+        state.save(update_fields=['digest', 'payload', 'updated_at'])
+
+    batch_id = current_batch()
+    for change_path, value in changes.items():
+        _queue(batch_id, change_path, value)
+    return len(changes)
+
+
+def delete_entity(path):
+    """Queue removal of the node at `path` (and everything below it)."""
+    forget(path)
+    _queue(current_batch(), path, None)
+
+
+def forget(path):
+    """Drop the remembered state for `path` and everything below it."""
+    from .models import FirebaseSyncState
+
+    FirebaseSyncState.objects.filter(path=path).delete()
+    FirebaseSyncState.objects.filter(path__startswith=f"{path}/").delete()
+
+
+def mark_synced(path, data):
+    """Record `data` as already present at `path` (used after bulk writes)."""
+    from .models import FirebaseSyncState
+
+    FirebaseSyncState.objects.update_or_create(
+        path=path, defaults={'digest': payload_digest(data), 'payload': data},
+    )
+
+
+def entity_node(obj):
+    """Full Firebase node for a model instance; orders carry their items nested."""
+    from .models import Order
+
+    data = obj.firebase_payload()
+    if isinstance(obj, Order):
+        data["items"] = {str(oi.pk): oi.firebase_payload() for oi in obj.items.all()}
+    return data
+
+
+def mark_node_synced(path, data):
+    """mark_synced() for a node written by entity_node(), nested items included."""
+    data = dict(data)
+    for item_id, item_data in data.pop("items", {}).items():
+        mark_synced(f"{path}/items/{item_id}", item_data)
+    mark_synced(path, data)
+
+
+def sync_new_node(path, data):
+    """
+    Queue a node that has never been synced (e.g. a new order with its items
+    nested) as a single write, remembering each part as mark_node_synced()
+    does, but in one query.
+    """
+    from .models import FirebaseSyncState
+
+    node = dict(data)
+    parts = {f"{path}/items/{item_id}": item_data for item_id, item_data in node.pop("items", {}).items()}
+    parts[path] = node
+    FirebaseSyncState.objects.bulk_create(
+        [FirebaseSyncState(path=p, digest=payload_digest(d), payload=d) for p, d in parts.items()],
+        update_conflicts=True, unique_fields=['path'], update_fields=['digest', 'payload', 'updated_at'],
+    )
+    _queue(current_batch(), path, data)
+
+
+def _queue(batch_id, path, value):
+    from .models import FirebaseOutbox
+
+    FirebaseOutbox.objects.update_or_create(
+        batch=batch_id, path=path, defaults={'payload': value},
+    )
+    transaction.on_commit(partial(_dispatch, batch_id))
+
+
+def _dispatch(batch_id):
+    # on_commit fires once per recorded write; only the first call sends.
+    # deliver_batch() keeps outbox order, so thread dispatch may finish in any order.
+    if getattr(_state, 'batch_id', None) != batch_id:
+        return
+    _state.batch_id = None
+
+    mode = settings.FIREBASE.get('DISPATCH', 'thread')
+    if mode == 'inline':
+        _deliver(batch_id)
+    elif mode == 'thread':
+        _get_executor().submit(_deliver_in_thread, batch_id)
+    # 'worker': leave it to manage.py process_firebase_outbox
+
+
+def _deliver(batch_id):
+    from .outbox import deliver_batch
+
+    deliver_batch(batch_id)
+
+
+def _deliver_in_thread(batch_id):
+    try:
+        _deliver(batch_id)
+    except Exception:
+        logger.exception("Firebase batch %s failed; the outbox worker will retry it", batch_id)
+    finally:
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.FIREBASE.get('DISPATCH_THREADS', 2),
+                thread_name_prefix='firebase-sync',
+            )
+        return _executor
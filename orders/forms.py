@@ -99,10 +99,21 @@ class LoginForm(forms.Form):
 class ItemForm(forms.ModelForm):
     class Meta:
         model = Item
-        fields = ['name', 'description', 'price', 'image', 'category']
+        fields = ['name', 'description', 'price', 'stock', 'available', 'image', 'category']
+
+    def save(self, commit=True):
+        item = super().save(commit=commit)
+        if commit and 'image' in self.changed_data:
+            # The upload is in storage now; build its srcset variants
+            item.refresh_image_variants()
+            item.save(update_fields=['image_variants'])
+        return item
 
 
 class OrderForm(forms.ModelForm):
+    # Issued with the empty form; see ordering.create_order
+    idempotency_key = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Order
         fields = ['full_name', 'phone', 'address']
@@ -111,3 +122,7 @@ class OrderForm(forms.ModelForm):
             'phone': forms.TextInput(attrs={'placeholder': 'Phone number', 'class': 'form-control'}),
             'address': forms.TextInput(attrs={'placeholder': 'Delivery address', 'class': 'form-control'}),
         }
+
+    def save(self, commit=True):
+        self.instance.idempotency_key = self.cleaned_data.get('idempotency_key')
+        return super().save(commit=commit)
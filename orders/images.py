@@ -0,0 +1,102 @@
+"""
+Resized variants of item images for responsive `srcset` markup.
+
+Each upload gets a JPEG (and, where Pillow supports it, WebP) copy at every
+configured width that is not larger than the original. The stored names are
+kept on Item.image_variants:
+
+    {"width": 1200, "height": 900,
+     "webp": {"120": "items/variants/<hash>.webp", ...},
+     "jpeg": {"120": "items/variants/<hash>.jpg", ...}}
+
+Item images use content-addressed storage (orders/storage.py), so the
+`stem-120w` names used here only decide the directory and extension.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+VARIANT_DIR = 'items/variants'
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def _config():
+    return getattr(settings, 'IMAGE_VARIANTS', {})
+
+
+def variant_widths():
+    return sorted(_config().get('WIDTHS', [120, 320, 640]))
+
+
+def variant_formats():
+    formats = _config().get('FORMATS', ['webp', 'jpeg'])
+    return [f for f in formats if f != 'webp' or features.check('webp')]
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.save(buffer, format=fmt.upper(), quality=_config().get('QUALITY', 80), optimize=True)
+    return buffer.getvalue()
+
+
+def generate_variants(field_file):
+    """Write resized copies of `field_file` to its storage and return their names."""
+    storage = field_file.storage
+    with field_file.open('rb') as f:
+        original = f.read()
+    source = Image.open(io.BytesIO(original))
+    source_format = (source.format or '').lower()
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+    # Never upscale: widths past the original are replaced by the original width.
+    configured = variant_widths()
+    widths = [w for w in configured if w < source.width]
+    if source.width <= configured[-1]:
+        widths.append(source.width)
+
+    stem = os.path.splitext(os.path.basename(field_file.name))[0]
+    variants = {'width': source.width, 'height': source.height}
+    for fmt in variant_formats():
+        encoded = {}
+        for width in widths:
+            height = max(1, round(source.height * width / source.width))
+            resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+            encoded[width] = _encode(resized, fmt)
+
+        # Small uploads are often already heavily compressed; re-encoding them
+        # at full size only makes them bigger.
+        native = encoded.get(source.width)
+        if native is not None and len(native) >= len(original):
+            if fmt != source_format:
+                continue  # browsers fall back to the other format's srcset
+            encoded[source.width] = original
+
+        variants[fmt] = {
+            str(width): storage.save(f"{VARIANT_DIR}/{stem}-{width}w.{EXTENSIONS[fmt]}", ContentFile(data))
+            for width, data in encoded.items()
+        }
+    return variants
+
+
+def srcset(variants, fmt, storage):
+    """`url 120w, url 320w, ...` for one format, or '' if there are none."""
+    names = (variants or {}).get(fmt, {})
+    return ", ".join(f"{storage.url(name)} {width}w"
+                     for width, name in sorted(names.items(), key=lambda kv: int(kv[0])))
+
+
+def smallest_at_least(variants, fmt, width, storage):
+    """URL of the narrowest variant at least `width` pixels wide (or the widest one)."""
+    names = (variants or {}).get(fmt, {})
+    if not names:
+        return None
+    widths = sorted(int(w) for w in names)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return storage.url(names[str(chosen)])
@@ -0,0 +1,179 @@
+"""
+Live order events for the kitchen dashboards (views.order_events streams
+them as Server-Sent Events).
+
+Order saves and deletes publish an event once their transaction commits
+(see signals.py); each open dashboard holds one subscription. The event
+carries the order's rows already rendered for both dashboards, so one
+render per change serves every screen; with no screen open nothing is
+rendered, so an order's own request pays nothing for the feed.
+
+settings.LIVE_ORDERS['BACKEND'] picks how events reach subscribers:
+
+- 'local'  an in-process broker; only screens served by the process that
+           saved the order see it, so use it with a single server process.
+- 'redis'  Redis pub/sub on LIVE_ORDERS['CHANNEL'], shared by every process
+           (needs the `redis` package and LIVE_ORDERS['REDIS_URL']).
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+ROW_TEMPLATES = {
+    'dashboard': 'dashboard/_order_rows.html',
+    'manage': 'orders/_manage_order_rows.html',
+}
+
+
+def _config():
+    return getattr(settings, 'LIVE_ORDERS', {})
+
+
+def order_event(order, kind):
+    """Event for `order`: kind is 'created', 'status', 'updated' or 'deleted'."""
+    event = {'type': kind, 'id': order.pk, 'status': order.status}
+    if kind != 'deleted':
+        event['rows'] = {
+            name: render_to_string(template, {'orders': [order]})
+            for name, template in ROW_TEMPLATES.items()
+        }
+    return event
+
+
+class LocalBroker:
+    """Fans events out to subscribers in this process, whatever thread publishes."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+    def subscribe(self):
+        return LocalSubscription(self)
+
+
+class LocalSubscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = asyncio.Queue(maxsize=_config().get('QUEUE_SIZE', 100))
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        with self.broker._lock:
+            self.broker._subscribers.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        with self.broker._lock:
+            self.broker._subscribers.discard(self)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Live order subscriber is not keeping up; dropped event for order %s", event['id'])
+
+    async def get(self, timeout):
+        """The next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class RedisBroker:
+    def __init__(self):
+        import redis
+
+        self.url = _config()['REDIS_URL']
+        self.channel = _config().get('CHANNEL', 'orders:live')
+        self.client = redis.Redis.from_url(self.url)
+
+    def has_subscribers(self):
+        return bool(self.client.pubsub_numsub(self.channel)[0][1])
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def subscribe(self):
+        return RedisSubscription(self)
+
+
+class RedisSubscription:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def __aenter__(self):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(self.broker.url)
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.broker.channel)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.pubsub.unsubscribe(self.broker.channel)
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def get(self, timeout):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+
+BACKENDS = {
+    'local': LocalBroker,
+    'redis': RedisBroker,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = BACKENDS[_config().get('BACKEND', 'local')]()
+        return _broker
+
+
+def publish(event):
+    try:
+        get_broker().publish(event)
+    except Exception:
+        # A dashboard missing an update must never fail the order that caused it.
+        logger.exception("Could not publish live order event for order %s", event['id'])
+
+
+def publish_order(order, kind):
+    try:
+        if not get_broker().has_subscribers():
+            return
+        # Reloaded with everything the row templates read, in three queries
+        # however many lines the order has.
+        order = Order.objects.select_related('user').prefetch_related('items__item').filter(pk=order.pk).first()
+        if order is None:
+            return  # deleted before this change committed; its removal is published
+        event = order_event(order, kind)
+    except Exception:
+        logger.exception("Could not render live order event for order %s", order.pk)
+        return
+    publish(event)
@@ -0,0 +1,97 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import firebase_sync
+from orders.firebase_client import get_client
+from orders.models import FirebaseOutbox, Item, Order
+
+# Collection -> payload field holding the id of the entity it belongs to.
+LEGACY_COLLECTIONS = {
+    'items': 'id',
+    'orders': 'order_id',
+    'order_items': 'order_id',
+    'payments': 'order_id',
+}
+
+
+def legacy_children(client, collection, page_size):
+    """
+    Yield pages of (push_id, value) pairs under /<collection>.
+    Push IDs start with '-', and the REST API sorts numeric keys before any
+    string, so starting at "-" skips the keyed nodes that are already compact.
+    """
+    start = None
+    while True:
+        page = client.request("GET", collection, params={
+            'orderBy': '"$key"',
+            'startAt': json.dumps(start or "-"),
+            'limitToFirst': page_size + (1 if start else 0),
+        }) or {}
+        rows = sorted((k, v) for k, v in page.items() if k != start and k.startswith("-"))
+        if not rows:
+            return
+        yield rows
+        start = rows[-1][0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the old append-only Firebase data (push-ID children under /items, "
+        "/orders, /order_items and /payments) into keyed nodes such as /orders/{id}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=200,
+                            help="Number of push-ID children to read per request.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be rewritten.")
+
+    def handle(self, *args, **options):
+        if FirebaseOutbox.objects.filter(sent_at__isnull=True, path__regex=r'^[a-z_]+/-').exists():
+            raise CommandError(
+                "The outbox still holds push-ID writes; run process_firebase_outbox first."
+            )
+
+        client = get_client()
+        written = set()
+        for collection, id_field in LEGACY_COLLECTIONS.items():
+            removed = 0
+            for rows in legacy_children(client, collection, options['page_size']):
+                update = {f"{collection}/{key}": None for key, _ in rows}
+                ids = {value.get(id_field) for _, value in rows if isinstance(value, dict)}
+                nodes = self.keyed_nodes(collection, ids - {None}, written)
+                update.update(nodes)
+                removed += len(rows)
+
+                if options['dry_run']:
+                    continue
+                client.request("PATCH", "", update)
+                for path, data in nodes.items():
+                    firebase_sync.mark_node_synced(path, data)
+
+            verb = "Would remove" if options['dry_run'] else "Removed"
+            self.stdout.write(f"/{collection}: {verb} {removed} push-ID children")
+
+        self.stdout.write(self.style.SUCCESS(f"{len(written)} keyed nodes written"))
+
+    def keyed_nodes(self, collection, ids, written):
+        """Current DB state of the entities referenced by a page of legacy data."""
+        nodes = {}
+        if collection == 'items':
+            for item in Item.objects.select_related('category').filter(pk__in=ids):
+                nodes[item.firebase_path()] = item.firebase_payload()
+        else:
+            # Order items and payments now live with their order, so rewrite
+            # the whole order (nested items) plus its payments.
+            orders = Order.objects.select_related('user').prefetch_related(
+                'items__item', 'payments'
+            ).filter(pk__in=ids)
+            for order in orders:
+                nodes[order.firebase_path()] = firebase_sync.entity_node(order)
+                for payment in order.payments.all():
+                    nodes[payment.firebase_path()] = payment.firebase_payload()
+
+        nodes = {path: data for path, data in nodes.items() if path not in written}
+        written.update(nodes)
+        return nodes
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from orders.firebase_emulator import FirebaseEmulator
+
+
+class Command(BaseCommand):
+    help = "Run a local in-memory stand-in for the Firebase Realtime Database REST API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9000)
+        parser.add_argument('--latency', type=float, default=0,
+                            help="Milliseconds added to every request.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of requests answered with HTTP 503 (0..1).")
+        parser.add_argument('--verbose', action='store_true', help="Log every request.")
+
+    def handle(self, *args, **options):
+        server = FirebaseEmulator(
+            options['host'], options['port'],
+            latency=options['latency'], error_rate=options['error_rate'],
+            verbose=options['verbose'],
+        )
+        self.stdout.write(f"Firebase emulator listening on {server.url} "
+                          f"(latency {options['latency']:.0f} ms, error rate {options['error_rate']:.0%})")
+        self.stdout.write(f"Use FIREBASE_DATABASE_URL={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,156 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import firebase_sync
+from orders.firebase_client import get_client
+from orders.models import Item, Order, Payment
+
+ENTITIES = {
+    'items': lambda: Item.objects.select_related('category'),
+    'orders': lambda: Order.objects.select_related('user').prefetch_related('items__item'),
+    'payments': lambda: Payment.objects.select_related('order'),
+}
+
+
+def normalize(value):
+    """
+    Bring local and remote data to the same shape before comparing: Firebase
+    drops nulls and empty objects, returns 500.0 as 500, and may return an
+    object with integer keys as a sparse array.
+    """
+    if isinstance(value, list):
+        value = {str(i): v for i, v in enumerate(value) if v is not None}
+    if isinstance(value, dict):
+        cleaned = {str(k): normalize(v) for k, v in value.items()}
+        return {k: v for k, v in cleaned.items() if v is not None and v != {}}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill or reconcile the Firebase mirror from the database, "
+        "using batched multi-path updates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('entities', nargs='*',
+                            help=f"Entities to sync: {', '.join(ENTITIES)} (default: all).")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Rows fetched per database round trip.")
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Nodes per multi-path update.")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Maximum number of updates in flight.")
+        parser.add_argument('--checkpoint', help="JSON file recording progress per entity.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue after the last id stored in --checkpoint.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Compare with the remote tree and push only differences.")
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume needs --checkpoint.")
+        unknown = set(options['entities']) - set(ENTITIES)
+        if unknown:
+            raise CommandError(f"Unknown entities: {', '.join(sorted(unknown))}")
+
+        self.client = get_client()
+        self.options = options
+        self.checkpoint = {}
+        if options['resume'] and os.path.exists(options['checkpoint']):
+            with open(options['checkpoint']) as f:
+                self.checkpoint = json.load(f)
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            self.executor = executor
+            for name in options['entities'] or ENTITIES:
+                self.sync_entity(name)
+
+    def sync_entity(self, name):
+        options = self.options
+        start_after = self.checkpoint.get(name, 0)
+        queryset = ENTITIES[name]().filter(pk__gt=start_after).order_by('pk')
+
+        in_flight = deque()
+        pushed = 0
+        previous = start_after
+        for rows in chunks(queryset.iterator(chunk_size=options['chunk_size']), options['batch_size']):
+            nodes = {obj.firebase_path(): firebase_sync.entity_node(obj) for obj in rows}
+            key_range = (previous + 1, rows[-1].pk)
+            previous = rows[-1].pk
+
+            while len(in_flight) >= options['concurrency']:
+                pushed += self.collect(name, in_flight, block=True)
+            in_flight.append((self.executor.submit(self.push, name, nodes, key_range), rows[-1].pk))
+            pushed += self.collect(name, in_flight)
+
+        while in_flight:
+            pushed += self.collect(name, in_flight, block=True)
+        if options['verify']:
+            pushed += self.mark(self.push(name, {}, (previous + 1, None)))
+
+        self.stdout.write(f"{name}: {pushed} nodes written")
+
+    def push(self, name, nodes, key_range):
+        """Runs in a worker thread. Returns the update that was sent."""
+        update = nodes
+        if self.options['verify']:
+            update = self.differences(name, nodes, key_range)
+        if update:
+            self.client.request("PATCH", "", update)
+        return update
+
+    def differences(self, name, nodes, key_range):
+        """Nodes that differ from the remote tree, plus removals of stray remote nodes."""
+        first, last = key_range
+        params = {'orderBy': '"$key"', 'startAt': json.dumps(str(first))}
+        if last is not None:
+            params['endAt'] = json.dumps(str(last))
+        remote = normalize(self.client.request("GET", name, params=params) or {})
+
+        update = {
+            path: data for path, data in nodes.items()
+            if normalize(data) != remote.get(path.split("/", 1)[1])
+        }
+        for key in remote:
+            if f"{name}/{key}" not in nodes:
+                update[f"{name}/{key}"] = None
+        return update
+
+    def collect(self, name, in_flight, block=False):
+        """Record finished pushes, advancing the checkpoint past completed batches only."""
+        if block:
+            wait([in_flight[0][0]], return_when=FIRST_COMPLETED)
+        pushed = 0
+        while in_flight and in_flight[0][0].done():
+            future, last_pk = in_flight.popleft()
+            pushed += self.mark(future.result())
+            self.save_checkpoint(name, last_pk)
+        return pushed
+
+    def mark(self, update):
+        for path, data in update.items():
+            if data is None:
+                firebase_sync.forget(path)
+            else:
+                firebase_sync.mark_node_synced(path, data)
+        return len(update)
+
+    def save_checkpoint(self, name, last_pk):
+        self.checkpoint[name] = last_pk
+        if self.options['checkpoint']:
+            with open(self.options['checkpoint'], 'w') as f:
+                json.dump(self.checkpoint, f)
@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import Item
+from orders.storage import is_hashed_name, item_image_storage
+
+ROOT = 'items'
+
+
+class Command(BaseCommand):
+    help = "Delete item image files (and variants) that no item references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be deleted.")
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help="Keep unreferenced files newer than this (uploads not yet saved to an item).")
+        parser.add_argument('--rehash', action='store_true',
+                            help="First move images stored under upload names to content-addressed names.")
+
+    def handle(self, *args, **options):
+        storage = item_image_storage()
+        if options['rehash']:
+            self.rehash(options['dry_run'])
+
+        referenced = set()
+        for image, variants in Item.objects.values_list('image', 'image_variants'):
+            if image:
+                referenced.add(image)
+            for fmt, names in (variants or {}).items():
+                if isinstance(names, dict):
+                    referenced.update(names.values())
+
+        cutoff = time.time() - options['grace_hours'] * 3600
+        deleted = kept = freed = 0
+        for name in self.walk(storage, ROOT):
+            if name in referenced:
+                kept += 1
+                continue
+            if storage.get_modified_time(name).timestamp() > cutoff:
+                continue
+            freed += storage.size(name)
+            deleted += 1
+            self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleting'} {name}")
+            if not options['dry_run']:
+                storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{deleted} orphaned files ({freed // 1024} KB), {kept} in use."
+        ))
+
+    def walk(self, storage, path):
+        if not storage.exists(path):
+            return
+        dirs, files = storage.listdir(path)
+        for f in files:
+            yield f"{path}/{f}"
+        for d in dirs:
+            yield from self.walk(storage, f"{path}/{d}")
+
+    def rehash(self, dry_run):
+        for item in Item.objects.exclude(image='').exclude(image__isnull=True).order_by('id'):
+            variants = [n for names in item.image_variants.values() if isinstance(names, dict)
+                        for n in names.values()]
+            if is_hashed_name(item.image.name) and all(is_hashed_name(n) for n in variants):
+                continue
+            self.stdout.write(f"Rehashing item {item.pk} ({item.image.name})")
+            if dry_run:
+                continue
+            try:
+                with item.image.open('rb') as f:
+                    item.image.name = item.image.storage.save(item.image.name, f)
+                if item.image_variants:
+                    item.refresh_image_variants()
+            except OSError as e:
+                self.stderr.write(f"Item {item.pk}: {e}")
+                continue
+            # save() so the new image URL reaches Firebase and the catalog cache;
+            # updated_at (auto_now is skipped unless listed) so menu API deltas do too
+            item.save(update_fields=['image', 'image_variants', 'updated_at'])
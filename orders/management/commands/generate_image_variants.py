@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.catalog import bump_catalog_version
+from orders.models import Item
+
+
+class Command(BaseCommand):
+    help = "Generate resized srcset variants for item images that do not have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate variants for every item, not just missing ones.")
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(image='').exclude(image__isnull=True).order_by('id')
+        if not options['force']:
+            items = items.filter(image_variants={})
+
+        done = failed = 0
+        for item in items.iterator():
+            try:
+                variants = item.refresh_image_variants()
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Item {item.pk} ({item.image.name}): {e}")
+                continue
+            # Variants are not part of the Firebase payload, so skip save()
+            Item.objects.filter(pk=item.pk).update(image_variants=variants, updated_at=timezone.now())
+            done += 1
+
+        if done:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} items ({failed} failed)."))
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.outbox import drain, prune
+
+PRUNE_INTERVAL = 3600  # seconds between retention passes while running
+
+
+class Command(BaseCommand):
+    help = "Deliver queued Firebase writes from the outbox table, retrying failures."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Maximum number of events per batch.")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain what is due right now and exit.")
+        parser.add_argument('--retention-days', type=float,
+                            default=settings.FIREBASE.get('OUTBOX_RETENTION_DAYS', 7),
+                            help="Delete delivered rows older than this many days.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        retention = timedelta(days=options['retention_days'])
+        last_pruned = None
+        while True:
+            if last_pruned is None or time.monotonic() - last_pruned >= PRUNE_INTERVAL:
+                pruned = prune(retention)
+                if pruned:
+                    self.stdout.write(f"Firebase outbox: pruned {pruned} delivered rows")
+                last_pruned = time.monotonic()
+
+            sent, failed = drain(batch_size=batch_size)
+            if sent or failed:
+                self.stdout.write(f"Firebase outbox: {sent} sent, {failed} failed")
+
+            if options['once']:
+                if sent + failed < batch_size:
+                    break
+                continue
+            if sent + failed < batch_size:
+                time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from orders import search
+from orders.catalog import bump_catalog_version
+from orders.models import Item
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for menu items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(f"No search index on {connection.vendor}; menu search uses icontains.")
+            return
+        with transaction.atomic():
+            count = search.rebuild(Item.objects.select_related('category'), options['batch_size'])
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} items."))
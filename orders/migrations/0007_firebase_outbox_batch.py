@@ -0,0 +1,49 @@
+import secrets
+import uuid
+
+from django.db import migrations, models
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def push_id(when):
+    """
+    A key in Firebase's push ID format, stamped with `when`, so the child
+    lands with the other append-only writes that compact_firebase rewrites.
+    """
+    now = int(when.timestamp() * 1000)
+    stamp = ""
+    for _ in range(8):
+        stamp = PUSH_CHARS[now % 64] + stamp
+        now //= 64
+    return stamp + "".join(secrets.choice(PUSH_CHARS) for _ in range(12))
+
+
+def key_pending_events(apps, schema_editor):
+    """Give rows queued as POSTs their own child key so they fit a multi-path update."""
+    FirebaseOutbox = apps.get_model('orders', 'FirebaseOutbox')
+    for event in FirebaseOutbox.objects.filter(sent_at__isnull=True):
+        event.path = f"{event.path}/{push_id(event.created_at)}"
+        event.batch = uuid.uuid4()
+        event.save(update_fields=['path', 'batch'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_firebase_outbox'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='firebaseoutbox',
+            name='method',
+        ),
+        migrations.AddField(
+            model_name='firebaseoutbox',
+            name='batch',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4),
+            preserve_default=False,
+        ),
+        migrations.RunPython(key_pending_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_firebase_outbox_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirebaseSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('digest', models.CharField(max_length=40)),
+                ('payload', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='firebaseoutbox',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+    ]
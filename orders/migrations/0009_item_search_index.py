@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from orders import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor)
+    Item = apps.get_model('orders', 'Item')
+    search.rebuild(Item.objects.select_related('category'), conn=schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_firebase_sync_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:56
+
+import orders.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=orders.storage.item_image_storage, upload_to='items/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_order_payment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='firebaseoutbox',
+            name='rejected_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-from .firebase_helper import send_to_firebase
+from django.utils import timezone
+
+from . import firebase_sync, images
+from .storage import item_image_storage
 
 
 # ========================
@@ -26,8 +30,13 @@ class Item(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=8, decimal_places=2)
     available = models.BooleanField(default=True)
-    image = models.ImageField(upload_to='items/', blank=True, null=True)
+    # Units left; blank means not tracked. Sold-out items turn unavailable (orders/stock.py)
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    image = models.ImageField(upload_to='items/', storage=item_image_storage, blank=True, null=True)
+    # Resized copies of `image`, see orders/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -42,9 +51,33 @@ class Item(models.Model):
         except:
             return '/static/img/placeholder.png'
 
+    @property
+    def image_srcset(self):
+        # {"webp": "url 120w, ...", "jpeg": "..."}; empty until variants exist
+        return {fmt: images.srcset(self.image_variants, fmt, self.image.storage)
+                for fmt in images.EXTENSIONS}
+
+    @property
+    def thumbnail_url(self):
+        # Small square thumbnails in the dashboard (60px, 2x for high-DPI screens)
+        return (images.smallest_at_least(self.image_variants, 'jpeg', 120, self.image.storage)
+                or self.image_url)
+
+    def refresh_image_variants(self):
+        # Old variant files may be shared with other items; gc_item_images removes them.
+        self.image_variants = images.generate_variants(self.image) if self.image else {}
+        return self.image_variants
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._queue_firebase_sync()
 
+    def _queue_firebase_sync(self):
+        # Queue for Firebase (sent once the transaction commits, only if changed)
+        firebase_sync.sync_entity(self.firebase_path(), self.firebase_payload())
+
+    def firebase_payload(self):
         # Prepare data for Firebase
         data = {
             "id": self.id,
@@ -56,15 +89,29 @@ class Item(models.Model):
             "image_url": self.image.url if self.image else None,
             "created_at": str(self.created_at),
         }
+        return data
+
+    def firebase_path(self):
+        return f"items/{self.pk}"
+
+
+class ItemTombstone(models.Model):
+    """Deleted item ids, so menu API clients syncing with ?since= can drop them."""
+    item_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
 
-        # Send to Firebase
-        send_to_firebase("items", data)
+    def __str__(self):
+        return f"Item #{self.item_id} deleted"
 
 
 
 # ========================
 # ORDER MODEL
 # ========================
+# Orders the kitchen still has to deal with
+ACTIVE_ORDER_STATUSES = ['pending', 'preparing']
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ("pending", "Pending"),
@@ -80,22 +127,71 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Denormalised from the lines, so order lists can show the size without
+    # loading them: units ordered and number of distinct lines.
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    # Issued with the checkout form; a resubmitted form finds its order
+    # instead of placing a second one (see ordering.create_order).
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        # Order lists are keyset-paginated newest first on (created_at, id)
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_recent_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_recent_idx'),
+            # The kitchen's queue: small however many orders have been delivered
+            models.Index(fields=['-created_at', '-id'], name='order_active_recent_idx',
+                         condition=models.Q(status__in=ACTIVE_ORDER_STATUSES)),
+        ]
 
     def _str_(self):
         return f"Order #{self.id} - {self.full_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        # Lets the live dashboard feed (signals.py) tell status changes from other edits
+        order._loaded_status = order.__dict__.get('status')
+        return order
+
     def calculate_total(self):
-        total = sum(item.get_subtotal() for item in self.items.all())
-        self.total_price = total
-        self.save()
-        return total
+        """Recompute total_price and the counts from the lines, in one UPDATE."""
+        # One transaction, so the queued Firebase write carries the total this
+        # UPDATE stored rather than one a concurrent recalculation left behind.
+        with transaction.atomic():
+            Order.objects.filter(pk=self.pk).update(**Order.line_totals())
+            self.refresh_from_db(fields=['total_price', 'item_count', 'line_count'])
+            self._queue_firebase_sync()  # change-aware: nothing is sent if the total held
+        return self.total_price
+
+    @staticmethod
+    def line_totals():
+        """total_price, item_count and line_count as subqueries on each order's lines."""
+        lines = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+
+        def aggregate(expression, output_field):
+            return Coalesce(models.Subquery(lines.annotate(v=expression).values('v'),
+                                            output_field=output_field), 0)
+
+        return {
+            'total_price': aggregate(models.Sum(models.F('quantity') * models.F('price')),
+                                     models.DecimalField(max_digits=10, decimal_places=2)),
+            'item_count': aggregate(models.Sum('quantity'), models.PositiveIntegerField()),
+            'line_count': aggregate(models.Count('pk'), models.PositiveIntegerField()),
+        }
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._queue_firebase_sync()
+
+    def _queue_firebase_sync(self):
+        # Queue for Firebase (sent once the transaction commits, only if changed)
+        firebase_sync.sync_entity(self.firebase_path(), self.firebase_payload())
 
+    def firebase_payload(self):
         # Prepare data for Firebase
         data = {
             "order_id": self.id,
@@ -107,8 +203,10 @@ class Order(models.Model):
             "total_price": float(self.total_price),
             "created_at": str(self.created_at),
         }
+        return data
 
-        send_to_firebase("orders", data)
+    def firebase_path(self):
+        return f"orders/{self.pk}"
 
 
 
@@ -128,8 +226,15 @@ class OrderItem(models.Model):
         return f"{self.quantity} x {self.item.name}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._queue_firebase_sync()
 
+    def _queue_firebase_sync(self):
+        # Queue for Firebase (sent once the transaction commits, only if changed)
+        firebase_sync.sync_entity(self.firebase_path(), self.firebase_payload())
+
+    def firebase_payload(self):
         # Prepare data for Firebase
         data = {
             "order_id": self.order.id,
@@ -138,8 +243,10 @@ class OrderItem(models.Model):
             "price": float(self.price),
             "subtotal": float(self.get_subtotal()),
         }
+        return data
 
-        send_to_firebase("order_items", data)
+    def firebase_path(self):
+        return f"orders/{self.order_id}/items/{self.pk}"
 
 
 
@@ -160,13 +267,23 @@ class Payment(models.Model):
     class Meta:
         verbose_name_plural = "payments"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order', '-created_at'], name='payment_order_recent_idx'),
+        ]
 
     def _str_(self):
         return f"Payment for Order #{self.order.id}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._queue_firebase_sync()
+
+    def _queue_firebase_sync(self):
+        # Queue for Firebase (sent once the transaction commits, only if changed)
+        firebase_sync.sync_entity(self.firebase_path(), self.firebase_payload())
 
+    def firebase_payload(self):
         # Prepare data for Firebase
         data = {
             "order_id": self.order.id,
@@ -177,5 +294,51 @@ class Payment(models.Model):
             "payment_id": self.provider_payment_id,
             "created_at": str(self.created_at),
         }
+        return data
+
+    def firebase_path(self):
+        return f"payments/{self.pk}"
+
+
+
+# ========================
+# FIREBASE OUTBOX MODEL
+# ========================
+class FirebaseOutbox(models.Model):
+    """
+    Pending Firebase writes. Rows are inserted in the same DB transaction as
+    the model change; each row is one path of a multi-path update, and rows
+    sharing a `batch` came from the same transaction.
+    """
+    batch = models.UUIDField(db_index=True)
+    path = models.CharField(max_length=255)
+    payload = models.JSONField(null=True)  # None deletes the node
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Set when Firebase refused the write (4xx); the row is never retried
+    rejected_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "firebase outbox"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        state = 'sent' if self.sent_at else 'rejected' if self.rejected_at else 'pending'
+        return f"/{self.path} ({state})"
+
+
+class FirebaseSyncState(models.Model):
+    """Last payload queued for each keyed Firebase node, used to skip no-op writes."""
+    path = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=40)
+    payload = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
 
-        send_to_firebase("payments", data)
\ No newline at end of file
+    def __str__(self):
+        return f"/{self.path}"
@@ -0,0 +1,77 @@
+"""
+Order creation: the order, its lines and the stock they take are written in
+one transaction, with a fixed number of queries however long the cart is,
+and reach Firebase as a single write once it commits.
+
+Checkout forms carry an idempotency key (Order.idempotency_key, unique), so
+a double-tapped or retried submission gets the order the first one placed
+rather than a duplicate.
+"""
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+
+from . import firebase_sync
+from .models import Order, OrderItem
+from .stock import reserve
+
+
+def new_idempotency_key():
+    return uuid.uuid4()
+
+
+def parse_idempotency_key(value):
+    """The UUID in a submitted key, or None if it is missing or malformed."""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def submitted_order(user, key):
+    """The order `user` already placed with idempotency `key`, or None."""
+    key = parse_idempotency_key(key)
+    if key is None:
+        return None
+    return Order.objects.filter(user=user, idempotency_key=key).first()
+
+
+def create_order(order, cart):
+    """
+    Save the unsaved `order` with a line per ResolvedCart line, priced as
+    resolved, and take their stock. Returns (order, created): if another
+    request already saved an order with the same idempotency key, that order
+    is returned and nothing is written. Raises stock.OutOfStock (and writes
+    nothing) if any line can't be filled.
+    """
+    lines = [OrderItem(item=line.item, quantity=line.quantity, price=line.item.price) for line in cart]
+    order.total_price = sum(line.get_subtotal() for line in lines)
+    order.item_count = sum(line.quantity for line in lines)
+    order.line_count = len(lines)
+
+    try:
+        with transaction.atomic():
+            # bulk_create skips save() and its per-row Firebase writes; the whole
+            # order is queued once below.
+            Order.objects.bulk_create([order])
+            for line in lines:
+                line.order = order
+            OrderItem.objects.bulk_create(lines)
+
+            # bulk_create sends no signals; the live dashboards listen for this one.
+            post_save.send(sender=Order, instance=order, created=True, update_fields=None,
+                           raw=False, using=order._state.db)
+
+            node = order.firebase_payload()
+            node["items"] = {str(line.pk): line.firebase_payload() for line in lines}
+            firebase_sync.sync_new_node(order.firebase_path(), node)
+
+            reserve(cart.stock_lines())  # last, so hot item rows are locked only until commit
+    except IntegrityError:
+        # A concurrent submission with the same key won the unique constraint.
+        existing = order.idempotency_key and submitted_order(order.user, order.idempotency_key)
+        if not existing:
+            raise
+        return existing, False
+    return order, True
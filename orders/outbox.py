@@ -0,0 +1,198 @@
+"""
+Delivery side of the Firebase outbox.
+
+Model saves only insert `FirebaseOutbox` rows. Rows are sent as one
+multi-path PATCH per batch, and failures are rescheduled with exponential
+backoff, so nothing is dropped while Firebase is slow or unreachable.
+
+Rows are delivered strictly in id order, whoever sends them: a row is only
+sent once every older row has been, so a retried write can never land on
+top of a newer one. Every sender goes through claim(), which only hands out
+a run of due rows at the head of the queue.
+Writes Firebase refuses outright (4xx) are set aside as rejected instead
+of being retried forever, and delivered rows are pruned after
+FIREBASE['OUTBOX_RETENTION_DAYS'] by `manage.py process_firebase_outbox`.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .firebase_client import FirebaseRejected, FirebaseUnavailable
+from .firebase_helper import push_to_firebase
+from .models import FirebaseOutbox
+
+logger = logging.getLogger(__name__)
+
+BASE_BACKOFF = 5  # seconds
+MAX_BACKOFF = 300  # seconds
+LEASE = 60  # seconds a worker may hold claimed rows before others retry them
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt, doubling up to MAX_BACKOFF."""
+    return min(BASE_BACKOFF * 2 ** max(attempts - 1, 0), MAX_BACKOFF)
+
+
+def unsent():
+    return FirebaseOutbox.objects.filter(sent_at__isnull=True, rejected_at__isnull=True)
+
+
+def backlog():
+    """Size and age of the undelivered outbox, for monitoring."""
+    pending = unsent()
+    oldest = pending.order_by('id').values_list('created_at', flat=True).first()
+    return {
+        'pending': pending.count(),
+        'oldest_pending_seconds': round((timezone.now() - oldest).total_seconds()) if oldest else 0,
+        'rejected': FirebaseOutbox.objects.filter(rejected_at__isnull=False).count(),
+    }
+
+
+def pending_events(now=None):
+    now = now or timezone.now()
+    return unsent().filter(next_attempt_at__lte=now)
+
+
+def prune(older_than):
+    """Delete rows delivered more than `older_than` (a timedelta) ago; returns how many."""
+    deleted, _ = FirebaseOutbox.objects.filter(sent_at__lt=timezone.now() - older_than).delete()
+    return deleted
+
+
+def merge_path(update, path, value):
+    """
+    Add `path: value` to a multi-path update. Firebase rejects updates where
+    one path is an ancestor of another, so overlapping writes are folded
+    into the ancestor's value instead.
+    """
+    for existing in list(update):
+        if existing.startswith(path + "/"):
+            del update[existing]  # overwritten by this write
+
+    parts = path.split("/")
+    for i in range(1, len(parts)):
+        ancestor = "/".join(parts[:i])
+        if ancestor in update:
+            node = update[ancestor]
+            if not isinstance(node, dict):
+                node = update[ancestor] = {}
+            for part in parts[i:-1]:
+                child = node.get(part)
+                if not isinstance(child, dict):
+                    child = node[part] = {}
+                node = child
+            node[parts[-1]] = value
+            return
+    update[path] = value
+
+
+def build_update(events):
+    """Merge outbox rows into one multi-path update; later rows win."""
+    update = {}
+    for event in sorted(events, key=lambda e: e.pk):
+        merge_path(update, event.path, event.payload)
+    return update
+
+
+def deliver(events):
+    """
+    Send `events` as a single PATCH to the database root. Returns True once
+    every row is done with (sent, or rejected by Firebase); on other
+    failures the rows are rescheduled and False is returned.
+    """
+    if not events:
+        return True
+    ids = [event.pk for event in events]
+    attempts = max(event.attempts for event in events) + 1
+    try:
+        push_to_firebase("", build_update(events), method="PATCH")
+    except FirebaseUnavailable as e:
+        # Circuit is open: nothing was sent, so don't count it as an attempt.
+        FirebaseOutbox.objects.filter(pk__in=ids).update(
+            last_error=str(e)[:1000],
+            next_attempt_at=timezone.now() + timedelta(seconds=max(e.retry_after, 1)),
+        )
+        return False
+    except FirebaseRejected as e:
+        if len(events) > 1:
+            # One merged write spoils the whole PATCH; send them one by one,
+            # oldest first, so only the bad rows are set aside.
+            return all(deliver([event]) for event in sorted(events, key=lambda e: e.pk))
+        FirebaseOutbox.objects.filter(pk__in=ids).update(
+            attempts=attempts, last_error=str(e)[:1000], rejected_at=timezone.now(),
+        )
+        logger.error("Firebase rejected the write to /%s; it will not be retried: %s", events[0].path, e)
+        return True
+    except Exception as e:
+        FirebaseOutbox.objects.filter(pk__in=ids).update(
+            attempts=attempts,
+            last_error=str(e)[:1000],
+            next_attempt_at=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+        )
+        logger.warning("Firebase outbox delivery of %s events failed (attempt %s): %s", len(ids), attempts, e)
+        return False
+
+    FirebaseOutbox.objects.filter(pk__in=ids).update(
+        attempts=attempts, last_error='', sent_at=timezone.now()
+    )
+    return True
+
+
+def deliver_batch(batch_id, batch_size=100):
+    """
+    Send everything one transaction queued, along with any older rows that
+    are due. Called right after commit. Returns False, leaving the batch to
+    the outbox worker, if an older row is waiting for a retry or is being
+    sent by someone else.
+    """
+    last = unsent().filter(batch=batch_id).aggregate(last=Max('id'))['last']
+    if last is None:
+        return True
+    while True:
+        events = claim(batch_size, up_to=last)
+        if not events or not deliver(events):
+            return False
+        if events[-1].pk >= last:
+            return True
+
+
+def claim(batch_size, up_to=None):
+    """
+    Reserve the due rows at the head of the queue (up to `batch_size`, and
+    none past id `up_to`) by pushing their next_attempt_at past a short
+    lease. The run stops at the first row that isn't due, because it is
+    backing off or leased to another sender, so rows leave in id order. No
+    transaction is held while they are sent.
+    """
+    now = timezone.now()
+    head = unsent().order_by('id')
+    if up_to is not None:
+        head = head.filter(pk__lte=up_to)
+    ids = []
+    for pk, next_attempt_at in head.values_list('pk', 'next_attempt_at')[:batch_size]:
+        if next_attempt_at > now:
+            break
+        ids.append(pk)
+    if not ids:
+        return []
+    # The random microseconds make the lease value unique to this claim.
+    lease = now + timedelta(seconds=LEASE, microseconds=random.randrange(1, 1000000))
+    if pending_events(now).filter(pk__in=ids).update(next_attempt_at=lease) != len(ids):
+        # Another sender claimed part of this run first; let it go ahead.
+        FirebaseOutbox.objects.filter(pk__in=ids, next_attempt_at=lease).update(next_attempt_at=now)
+        return []
+    return list(FirebaseOutbox.objects.filter(pk__in=ids).order_by('id'))
+
+
+def drain(batch_size=100):
+    """
+    Deliver up to `batch_size` due events, oldest first, in one request.
+    Returns a (sent, failed) tuple.
+    """
+    events = claim(batch_size)
+    if deliver(events):
+        return len(events), 0
+    return 0, len(events)
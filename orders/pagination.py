@@ -0,0 +1,86 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are sliced with `WHERE (created_at, id) < (cursor)` on an ordered
+queryset instead of OFFSET, so each page costs the same no matter how deep
+it is or how big the table grows. The cursor is an opaque url-safe token.
+"""
+import base64
+import json
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+@dataclass
+class KeysetPage:
+    items: list = field(default_factory=list)
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def page_size_from(request):
+    """?page_size=N, clamped to settings.PAGINATION['MAX_PAGE_SIZE']."""
+    config = settings.PAGINATION
+    try:
+        size = int(request.GET.get('page_size', config['PAGE_SIZE']))
+    except ValueError:
+        size = config['PAGE_SIZE']
+    return max(1, min(size, config['MAX_PAGE_SIZE']))
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Cursor token -> [datetime, pk], or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        stamp, pk = json.loads(raw)
+        stamp = parse_datetime(stamp)
+        return [stamp, int(pk)] if stamp else None
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(queryset, cursor=None, page_size=None, key=('created_at', 'id')):
+    """
+    Newest-first page of `queryset` after `cursor`, ordered by `key`
+    (a timestamp field and a unique tiebreaker).
+    """
+    page_size = page_size or settings.PAGINATION['PAGE_SIZE']
+    stamp_field, id_field = key
+    queryset = queryset.order_by(f'-{stamp_field}', f'-{id_field}')
+
+    position = decode_cursor(cursor)
+    if position:
+        stamp, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{stamp_field}__lt': stamp}) | Q(**{stamp_field: stamp, f'{id_field}__lt': pk})
+        )
+
+    rows = list(queryset[:page_size + 1])
+    items = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, stamp_field), getattr(last, id_field)])
+    return KeysetPage(items, next_cursor)
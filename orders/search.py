@@ -0,0 +1,152 @@
+"""
+Full-text search over item name, description and category name.
+
+SQLite uses an FTS5 table (`orders_item_fts`, rowid = item id); PostgreSQL
+uses a weighted tsvector column with a GIN index (`orders_item_search`).
+Both are created by migration 0009, kept current by signals and rebuilt with
+`manage.py rebuild_search_index`. On other databases `search_item_ids()`
+returns None and callers fall back to a plain icontains filter.
+"""
+import re
+
+from django.db import connection
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Relative weight of matches in name, description and category.
+FTS5_WEIGHTS = (10.0, 1.0, 5.0)
+
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS orders_item_fts USING fts5("
+    "name, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS orders_item_fts"]
+
+POSTGRES_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS orders_item_search ("
+    "item_id bigint PRIMARY KEY REFERENCES orders_item(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS orders_item_search_document_gin ON orders_item_search USING GIN (document)",
+]
+POSTGRES_DROP = ["DROP TABLE IF EXISTS orders_item_search"]
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', %s), 'A') || "
+    "setweight(to_tsvector('simple', %s), 'B') || "
+    "setweight(to_tsvector('simple', %s), 'C')"
+)
+
+
+def is_supported(conn=connection):
+    return conn.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(schema_editor):
+    statements = {'sqlite': SQLITE_SCHEMA, 'postgresql': POSTGRES_SCHEMA}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_index(schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def _document(item):
+    category = item.category.name if item.category_id and item.category else ''
+    return item.name, item.description or '', category
+
+
+def index_items(items, conn=connection):
+    """Insert or replace the index rows for `items`."""
+    if not is_supported(conn):
+        return
+    rows = [(item.pk, *_document(item)) for item in items]
+    if not rows:
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.executemany("DELETE FROM orders_item_fts WHERE rowid = %s", [(r[0],) for r in rows])
+            cursor.executemany(
+                "INSERT INTO orders_item_fts (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO orders_item_search (item_id, document) VALUES (%s, {POSTGRES_DOCUMENT}) "
+                "ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document",
+                [(pk, name, category, description) for pk, name, description, category in rows],
+            )
+
+
+def remove_items(item_ids, conn=connection):
+    if not is_supported(conn):
+        return
+    table, column = (
+        ('orders_item_fts', 'rowid') if conn.vendor == 'sqlite' else ('orders_item_search', 'item_id')
+    )
+    with conn.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {table} WHERE {column} = %s", [(pk,) for pk in item_ids])
+
+
+def rebuild(queryset, batch_size=500, conn=connection):
+    """Recreate the whole index from `queryset` (Items with their category)."""
+    if not is_supported(conn):
+        return 0
+    table = 'orders_item_fts' if conn.vendor == 'sqlite' else 'orders_item_search'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+    count = 0
+    batch = []
+    for item in queryset.iterator(chunk_size=batch_size):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            index_items(batch, conn)
+            count += len(batch)
+            batch = []
+    index_items(batch, conn)
+    return count + len(batch)
+
+
+def search_item_ids(query, limit=None, available=None, category_id=None, conn=connection):
+    """
+    Item ids matching every word of `query` (as a prefix), best match first.
+    `available` and `category_id` filter in the same query, before `limit`
+    is applied. Returns None when the database has no search index.
+    """
+    if not is_supported(conn):
+        return None
+    words = WORD_RE.findall(query.lower())
+    if not words:
+        return []
+
+    filter_sql, filter_params = "", []
+    if available is not None:
+        filter_sql += " AND orders_item.available = %s"
+        filter_params.append(available)
+    if category_id is not None:
+        filter_sql += " AND orders_item.category_id = %s"
+        filter_params.append(category_id)
+    limit_sql = " LIMIT %d" % int(limit) if limit else ""
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            match = " ".join('"%s"*' % word for word in words)
+            cursor.execute(
+                "SELECT orders_item_fts.rowid FROM orders_item_fts "
+                "JOIN orders_item ON orders_item.id = orders_item_fts.rowid "
+                "WHERE orders_item_fts MATCH %s" + filter_sql +
+                " ORDER BY bm25(orders_item_fts, %s, %s, %s)" + limit_sql,
+                [match, *filter_params, *FTS5_WEIGHTS],
+            )
+        else:
+            tsquery = " & ".join(f"{word}:*" for word in words)
+            cursor.execute(
+                "SELECT item_id FROM orders_item_search "
+                "JOIN orders_item ON orders_item.id = orders_item_search.item_id, "
+                "to_tsquery('simple', %s) query "
+                "WHERE document @@ query" + filter_sql +
+                " ORDER BY ts_rank(document, query) DESC, item_id" + limit_sql,
+                [tsquery, *filter_params],
+            )
+        return [row[0] for row in cursor.fetchall()]
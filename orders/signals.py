@@ -1,8 +1,86 @@
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Item
-from .firebase_functions import save_item_to_firebase
+from django.utils import timezone
+
+from . import firebase_sync, live, search
+from .catalog import bump_catalog_version, tombstone_retention
+from .models import Category, Item, ItemTombstone, Order, OrderItem, Payment
+
+
+# Saves are mirrored to Firebase from each model's save(); deletes are
+# handled here so cascaded rows (e.g. an order's items) are covered too.
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_delete, sender=Payment)
+def remove_from_firebase(sender, instance, **kwargs):
+    firebase_sync.delete_entity(instance.firebase_path())
+
+
+# Live kitchen dashboards (see orders/live.py)
+@receiver(post_save, sender=Order)
+def publish_order_change(sender, instance, created, **kwargs):
+    if created:
+        kind = 'created'
+    elif instance.status != getattr(instance, '_loaded_status', None):
+        kind = 'status'
+    else:
+        kind = 'updated'
+    instance._loaded_status = instance.status
+    transaction.on_commit(partial(live.publish_order, instance, kind))
+
+
+@receiver(post_delete, sender=Order)
+def publish_order_removal(sender, instance, **kwargs):
+    # Built now: the instance loses its pk once the delete finishes.
+    transaction.on_commit(partial(live.publish, live.order_event(instance, 'deleted')))
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    # After commit, so a concurrent request can't cache the old rows under the new version.
+    transaction.on_commit(bump_catalog_version)
 
+
+@receiver(post_delete, sender=Item)
+def record_item_tombstone(sender, instance, **kwargs):
+    # Lets menu API delta clients (?since=) drop the item; deletes are rare,
+    # so expired tombstones are pruned here too.
+    ItemTombstone.objects.create(item_id=instance.pk)
+    ItemTombstone.objects.filter(deleted_at__lt=timezone.now() - tombstone_retention()).delete()
+
+
+# Search index (see orders/search.py)
 @receiver(post_save, sender=Item)
-def sync_item_to_firebase(sender, instance, **kwargs):
-    save_item_to_firebase(instance)
+def index_item(sender, instance, **kwargs):
+    search.index_items([instance])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    search.remove_items([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        search.index_items(Item.objects.filter(category=instance).select_related('category'))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_items(sender, instance, **kwargs):
+    instance._search_item_ids = list(Item.objects.filter(category=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorised_items(sender, instance, **kwargs):
+    # SET_NULL is a bulk update, so Item post_save doesn't fire for these.
+    ids = getattr(instance, '_search_item_ids', [])
+    Item.objects.filter(pk__in=ids).update(updated_at=timezone.now())  # for menu API deltas
+    search.index_items(Item.objects.filter(pk__in=ids).select_related('category'))
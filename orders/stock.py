@@ -0,0 +1,62 @@
+"""
+Per-item stock, decremented inside the checkout transaction.
+
+Stock is taken with a conditional UPDATE (`stock = stock - n WHERE stock >= n`),
+so concurrent checkouts can never oversell or lose a decrement, and nothing
+is read-locked up front: the row lock is taken by the UPDATE itself and
+held only until the order commits. Items without a stock count (NULL) are
+not tracked and only need to be available.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .models import Item
+
+
+class OutOfStock(Exception):
+    def __init__(self, items):
+        self.items = items
+        super().__init__("Not enough stock for: " + ", ".join(items))
+
+
+def reserve(lines):
+    """
+    Take stock for `lines` ((Item, quantity) pairs) in the current
+    transaction, or raise OutOfStock naming every line that can't be filled.
+    All tracked lines are taken with one UPDATE, however many there are.
+    Call it last in the transaction, right before commit, so the item rows
+    stay locked as briefly as possible.
+    """
+    short = [item.name for item, qty in lines if item.stock is None and not item.available]
+    tracked = {item.pk: qty for item, qty in lines if item.stock is not None}
+    if tracked:
+        wanted = Case(*[When(pk=pk, then=Value(qty)) for pk, qty in tracked.items()])
+        try:
+            with transaction.atomic():
+                taken = (Item.objects.filter(pk__in=tracked, available=True, stock__gte=wanted)
+                         .update(stock=F('stock') - wanted))
+                if taken != len(tracked):
+                    raise OutOfStock([])  # undo the lines that did fit
+        except OutOfStock:
+            current = Item.objects.in_bulk(tracked)
+            short += [item.name for item, qty in lines if item.pk in tracked and (
+                item.pk not in current or not current[item.pk].available
+                or current[item.pk].stock < qty)]
+    if short:
+        raise OutOfStock(short)
+    mark_sold_out(tracked)
+
+
+def mark_sold_out(item_ids):
+    """Flip items whose stock reached zero to unavailable."""
+    sold_out = list(Item.objects.filter(pk__in=item_ids, stock=0, available=True)
+                    .values_list('pk', flat=True))
+    if not sold_out:
+        return
+    # UPDATE skips save() and its signals, so do their work here.
+    Item.objects.filter(pk__in=sold_out).update(available=False, updated_at=timezone.now())
+    for item in Item.objects.filter(pk__in=sold_out).select_related('category'):
+        item._queue_firebase_sync()
+    transaction.on_commit(bump_catalog_version)
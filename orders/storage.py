@@ -0,0 +1,71 @@
+"""
+Content-addressed storage for item images.
+
+Files are named after the SHA-256 of their bytes, so uploading the same
+picture twice stores it once, and a URL never points at different content.
+That makes the files safe to cache forever (see views.serve_media). Files
+are shared between items and never deleted when an item changes or goes
+away; `manage.py gc_item_images` removes the ones nothing references.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_LENGTH = 32
+HASHED_NAME = re.compile(r'^[0-9a-f]{%d}(\.[0-9a-z]+)?$' % HASH_LENGTH)
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():  # chunks() rewinds first
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def is_hashed_name(name):
+    return bool(HASHED_NAME.match(os.path.basename(name)))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, content_hash(content) + ext).replace('\\', '/')
+        if self.exists(name):
+            self._touch(name)
+            return name
+        return super().save(name, content, max_length)
+
+    def _touch(self, name):
+        # A fresh mtime keeps gc_item_images' grace period from deleting a
+        # file that was just re-uploaded but isn't referenced yet.
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass  # collected in the meantime; the next save writes it again
+
+    def get_available_name(self, name, max_length=None):
+        if is_hashed_name(name) and self.exists(name):
+            # A concurrent upload of the same bytes got there first; its file
+            # is identical, so there is nothing to rename. See _save().
+            raise FileExistsError(name)
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            self._touch(name)
+            return name
+
+
+def item_image_storage():
+    return ContentAddressedStorage()
@@ -1,3 +1,1054 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, Item, Order, FirebaseOutbox, FirebaseSyncState, Payment
+from . import live, outbox, search, views
+from .firebase_client import CircuitBreaker, FirebaseClient, FirebaseError, FirebaseRejected, FirebaseUnavailable
+from .firebase_emulator import FirebaseEmulator
+from .cart import resolve_cart
+from .cart_store import CacheCartStore, CartSummary, get_cart_store
+from .forms import ItemForm
+from .ordering import create_order, new_idempotency_key
+from .pagination import keyset_paginate
+from .storage import is_hashed_name
+
+
+# cart_for() fills carts from outside the test client, so tests that use it
+# need a store that isn't the client's session.
+CACHE_CART = {'STORE': 'cache', 'CACHE': 'carts'}
+
+
+def cart_for(user):
+    request = RequestFactory().get("/")
+    request.user = user
+    return get_cart_store(request)
+
+
+def place_order(client):
+    """Submit the cart page's quick order form."""
+    return client.post(reverse('orders:place-order'), {'idempotency_key': new_idempotency_key()})
+
+
+def fill_cart(user, lines):
+    cart = cart_for(user)
+    cart.clear()
+    for item_id, quantity in lines.items():
+        cart.set(item_id, quantity)
+    return cart
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class FirebaseOutboxTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Drinks")
+
+    def test_save_queues_event_without_network(self):
+        with mock.patch('orders.outbox.push_to_firebase') as push:
+            item = Item.objects.create(name="Juice", price=500, category=self.category)
+        push.assert_not_called()
+        event = FirebaseOutbox.objects.get(path__startswith="items/")
+        self.assertEqual(event.payload["id"], item.id)
+        self.assertIsNone(event.sent_at)
+
+    def test_drain_sends_one_multi_path_update(self):
+        Item.objects.create(name="Juice", price=500)
+        Item.objects.create(name="Tea", price=300)
+        with mock.patch('orders.outbox.push_to_firebase') as push:
+            sent, failed = outbox.drain()
+        self.assertEqual((sent, failed), (2, 0))
+        push.assert_called_once()
+        path, update = push.call_args.args
+        self.assertEqual(path, "")
+        self.assertEqual(len(update), 2)
+        self.assertFalse(outbox.pending_events().exists())
+
+    def test_failed_delivery_is_retried_later(self):
+        Item.objects.create(name="Juice", price=500)
+        with mock.patch('orders.outbox.push_to_firebase', side_effect=OSError("down")):
+            sent, failed = outbox.drain()
+        self.assertEqual((sent, failed), (0, 1))
+        event = FirebaseOutbox.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNone(event.sent_at)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+
+    def test_writes_reach_firebase_in_outbox_order(self):
+        firebase = {}
+
+        def push(path, update, method):
+            for key, value in update.items():
+                node = firebase
+                *parents, leaf = key.split("/")
+                for part in parents:
+                    node = node.setdefault(part, {})
+                node[leaf] = value
+
+        with override_settings(FIREBASE={'DISPATCH': 'inline'}):
+            with mock.patch('orders.outbox.push_to_firebase', side_effect=OSError("down")):
+                with self.captureOnCommitCallbacks(execute=True):
+                    order = Order.objects.create(full_name="Ana", phone="1", address="x")
+            with mock.patch('orders.outbox.push_to_firebase', side_effect=push) as sent:
+                with self.captureOnCommitCallbacks(execute=True):
+                    order.status = 'preparing'
+                    order.save()
+        # The create batch is still backing off, so the status change waits behind it.
+        sent.assert_not_called()
+        self.assertEqual(outbox.unsent().count(), 2)
+
+        FirebaseOutbox.objects.update(next_attempt_at=timezone.now())
+        with mock.patch('orders.outbox.push_to_firebase', side_effect=push):
+            self.assertEqual(outbox.drain(), (2, 0))
+        self.assertEqual(firebase["orders"][str(order.pk)]["status"], "preparing")
+
+    def test_claims_never_overlap_or_skip_ahead(self):
+        for name in ("Juice", "Tea", "Cake"):
+            Item.objects.create(name=name, price=500)
+        first = outbox.claim(2)
+        self.assertEqual(len(first), 2)
+        # The head of the queue is leased to the first sender, so nothing else may go.
+        self.assertEqual(outbox.claim(10), [])
+
+    def test_rejected_write_is_set_aside_and_the_rest_delivered(self):
+        for name in ("Juice", "Tea", "Cake"):
+            Item.objects.create(name=name, price=500)
+        bad = FirebaseOutbox.objects.order_by('id')[1]
+
+        def push(path, update, method):
+            if bad.path in update:
+                raise FirebaseRejected("400 Client Error")
+
+        with mock.patch('orders.outbox.push_to_firebase', side_effect=push) as sent:
+            self.assertEqual(outbox.drain(), (3, 0))
+        self.assertEqual(sent.call_count, 4)  # the merged PATCH, then one per row
+        bad.refresh_from_db()
+        self.assertIsNotNone(bad.rejected_at)
+        self.assertEqual(FirebaseOutbox.objects.filter(sent_at__isnull=False).count(), 2)
+        self.assertFalse(outbox.pending_events().exists())
+        self.assertEqual(outbox.backlog()['rejected'], 1)
+
+    def test_worker_prunes_old_delivered_rows(self):
+        Item.objects.create(name="Juice", price=500)
+        Item.objects.create(name="Tea", price=300)
+        old, recent = FirebaseOutbox.objects.order_by('id')
+        FirebaseOutbox.objects.filter(pk=old.pk).update(sent_at=timezone.now() - timedelta(days=8))
+        FirebaseOutbox.objects.filter(pk=recent.pk).update(sent_at=timezone.now() - timedelta(days=1))
+        call_command('process_firebase_outbox', '--once', stdout=io.StringIO())
+        self.assertEqual(list(FirebaseOutbox.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+@override_settings(FIREBASE={'DISPATCH': 'inline'}, CART=CACHE_CART)
+class FirebaseBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ana@example.com", "ana@example.com", "pw")
+        self.client.force_login(self.user)
+        self.items = [Item.objects.create(name=f"Item {i}", price=100 + i) for i in range(10)]
+        FirebaseOutbox.objects.all().delete()
+
+    def test_place_order_is_sent_as_single_update(self):
+        fill_cart(self.user, {str(item.pk): 1 for item in self.items})
+
+        with mock.patch('orders.outbox.push_to_firebase') as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                place_order(self.client)
+
+        push.assert_called_once()
+        update = push.call_args.args[1]
+        # One keyed order node (saved twice, sent once) with its ten items nested.
+        order = Order.objects.get()
+        self.assertEqual(list(update), [f"orders/{order.pk}"])
+        self.assertEqual(len(update[f"orders/{order.pk}"]["items"]), 10)
+        self.assertEqual(update[f"orders/{order.pk}"]["total_price"], float(order.total_price))
+
+    def test_rolled_back_transaction_sends_nothing(self):
+        with mock.patch('orders.outbox.push_to_firebase') as push:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        Order.objects.create(full_name="Ana", phone="1", address="x")
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+        push.assert_not_called()
+        self.assertFalse(FirebaseOutbox.objects.exists())
+
+
+class FirebaseClientTests(TestCase):
+    def make_client(self, *responses, **kwargs):
+        client = FirebaseClient(base_url="http://firebase.test/", backoff=0, **kwargs)
+        client.session.request = mock.Mock(side_effect=list(responses))
+        return client
+
+    def response(self, status, body=None):
+        resp = mock.Mock(status_code=status)
+        resp.json.return_value = body
+        resp.raise_for_status.return_value = None
+        return resp
+
+    def test_retries_server_errors_with_timeouts(self):
+        client = self.make_client(self.response(503), self.response(200, {"ok": True}))
+        self.assertEqual(client.request("PATCH", "", {"a": 1}), {"ok": True})
+        _, kwargs = client.session.request.call_args
+        self.assertEqual(kwargs['timeout'], client.timeout)
+        stats = client.stats()
+        self.assertEqual((stats['retries'], stats['successes'], stats['failures']), (1, 1, 0))
+
+    def test_open_circuit_fails_fast(self):
+        client = self.make_client(
+            *[self.response(500)] * 3, max_retries=0,
+            breaker=CircuitBreaker(threshold=3, reset_timeout=60),
+        )
+        for _ in range(3):
+            with self.assertRaises(FirebaseError):
+                client.request("PATCH", "", {})
+        with self.assertRaises(FirebaseUnavailable):
+            client.request("PATCH", "", {})
+        self.assertEqual(client.session.request.call_count, 3)
+        self.assertEqual(client.stats()['circuit'], "open")
+        self.assertEqual(client.stats()['error_rate'], 1.0)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class ChangeAwareSyncTests(TestCase):
+    def test_unchanged_save_queues_nothing(self):
+        item = Item.objects.create(name="Juice", price=500)
+        self.assertEqual(FirebaseOutbox.objects.count(), 1)
+        item.save()
+        self.assertEqual(FirebaseOutbox.objects.count(), 1)
+
+    def test_changed_save_queues_only_changed_fields(self):
+        item = Item.objects.create(name="Juice", price=500)
+        item.price = 600
+        item.save()
+        paths = list(FirebaseOutbox.objects.values_list('path', flat=True))
+        self.assertEqual(paths, [f"items/{item.pk}", f"items/{item.pk}/price"])
+
+    def test_overlapping_paths_fold_into_one_update(self):
+        item = Item.objects.create(name="Juice", price=500)
+        item.price = 600
+        item.save()
+        update = outbox.build_update(list(FirebaseOutbox.objects.all()))
+        self.assertEqual(list(update), [f"items/{item.pk}"])
+        self.assertEqual(update[f"items/{item.pk}"]["price"], 600.0)
+
+    def test_delete_removes_node(self):
+        item = Item.objects.create(name="Juice", price=500)
+        item_path = item.firebase_path()
+        item.delete()
+        event = FirebaseOutbox.objects.get(path=item_path, payload__isnull=True)
+        self.assertIsNone(event.payload)
+        self.assertFalse(FirebaseSyncState.objects.filter(path=item_path).exists())
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class CompactFirebaseTests(TestCase):
+    def test_push_id_children_are_replaced_by_keyed_nodes(self):
+        order = Order.objects.create(full_name="Ana", phone="1", address="x")
+        FirebaseOutbox.objects.update(sent_at=timezone.now())
+        legacy = {
+            "-Nabc": {"order_id": order.pk, "status": "pending"},
+            "-Nabd": {"order_id": order.pk, "status": "preparing"},
+        }
+        client = mock.Mock()
+        client.request.side_effect = lambda method, path, data=None, params=None: (
+            (legacy if path == "orders" and params["startAt"] == '"-"' else {})
+            if method == "GET" else None
+        )
+        with mock.patch('orders.management.commands.compact_firebase.get_client', return_value=client):
+            call_command('compact_firebase', stdout=mock.Mock())
+
+        patches = [c.args[2] for c in client.request.call_args_list if c.args[0] == "PATCH"]
+        self.assertEqual(len(patches), 1)
+        self.assertIsNone(patches[0]["orders/-Nabc"])
+        self.assertIsNone(patches[0]["orders/-Nabd"])
+        self.assertEqual(patches[0][f"orders/{order.pk}"]["items"], {})
+
+
+class LazyFirebaseAdminTests(TestCase):
+    def test_startup_does_not_load_admin_sdk(self):
+        code = (
+            "import os, sys, django;"
+            "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'canteen_project.settings');"
+            "django.setup();"
+            "print('firebase_admin' in sys.modules)"
+        )
+        out = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR,
+                             capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), "False")
+
+    @override_settings(FIREBASE={'ADMIN_SDK_ENABLED': False})
+    def test_disabled_admin_sdk_raises(self):
+        from .firebase import get_firebase_db
+        with self.assertRaises(ImproperlyConfigured):
+            get_firebase_db()
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class FirebaseBackfillTests(TestCase):
+    def setUp(self):
+        self.items = [Item.objects.create(name=f"Item {i}", price=100) for i in range(5)]
+        self.client_mock = mock.Mock()
+        patcher = mock.patch('orders.management.commands.firebase_sync.get_client',
+                             return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def patches(self):
+        return [c.args[2] for c in self.client_mock.request.call_args_list if c.args[0] == "PATCH"]
+
+    def test_backfill_batches_and_checkpoints(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, "sync.json")
+            call_command('firebase_sync', 'items', batch_size=2, checkpoint=checkpoint,
+                         stdout=mock.Mock())
+            with open(checkpoint) as f:
+                self.assertEqual(json.load(f), {"items": self.items[-1].pk})
+
+            self.assertEqual([len(p) for p in self.patches()], [2, 2, 1])
+
+            self.client_mock.reset_mock()
+            call_command('firebase_sync', 'items', checkpoint=checkpoint, resume=True,
+                         stdout=mock.Mock())
+            self.assertEqual(self.patches(), [])
+
+    def test_verify_pushes_only_differences(self):
+        remote = {str(item.pk): item.firebase_payload() for item in self.items}
+        remote[str(self.items[0].pk)]["price"] = 1  # stale remote copy
+        ghost = self.items[2].firebase_path()
+        Item.objects.filter(pk=self.items[2].pk).delete()  # deleted while sync was down
+        self.client_mock.request.side_effect = lambda method, path, data=None, params=None: (
+            remote if method == "GET" and params.get('endAt') else {} if method == "GET" else None
+        )
+        call_command('firebase_sync', 'items', verify=True, stdout=mock.Mock())
+
+        update, = self.patches()
+        self.assertEqual(set(update), {self.items[0].firebase_path(), ghost})
+        self.assertIsNone(update[ghost])
+
+
+class FirebaseEmulatorTests(TestCase):
+    def setUp(self):
+        self.server = FirebaseEmulator().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client_ = FirebaseClient(self.server.url, max_retries=0)
+
+    def test_multi_path_patch_and_key_queries(self):
+        self.client_.request("PATCH", "", {"orders/2": {"status": "pending"}, "orders/10/status": "preparing"})
+        self.client_.request("POST", "orders", {"legacy": True})
+        self.client_.request("PATCH", "", {"orders/2/status": None})
+
+        keyed = self.client_.request("GET", "orders", params={
+            'orderBy': '"$key"', 'startAt': '"1"', 'endAt': '"10"',
+        })
+        self.assertEqual(keyed, {"10": {"status": "preparing"}})
+        legacy = self.client_.request("GET", "orders", params={'orderBy': '"$key"', 'startAt': '"-"'})
+        self.assertEqual(list(legacy.values()), [{"legacy": True}])
+
+    def test_injected_errors(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(FirebaseError):
+            self.client_.request("GET", "")
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Drinks")
+        self.item = Item.objects.create(name="Juice", price=500, category=self.category)
+
+    def test_repeat_menu_render_skips_item_query(self):
+        self.client.get(reverse('orders:menu'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('orders:menu'))
+        self.assertContains(response, "Juice")
+
+    def test_item_change_bumps_version(self):
+        self.client.get(reverse('orders:category-items', args=[self.category.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.name = "Fresh juice"
+            self.item.save()
+        response = self.client.get(reverse('orders:category-items', args=[self.category.pk]))
+        self.assertContains(response, "Fresh juice")
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        drinks = Category.objects.create(name="Drinks")
+        self.juice = Item.objects.create(name="Passion juice", price=500, category=drinks)
+        self.tea = Item.objects.create(name="Tea", description="Served with passion fruit", price=300)
+        self.cake = Item.objects.create(name="Cake", price=800)
+
+    def test_ranked_prefix_search(self):
+        # Name matches outrank description matches.
+        self.assertEqual(search.search_item_ids("pass"), [self.juice.pk, self.tea.pk])
+        self.assertEqual(search.search_item_ids("drinks"), [self.juice.pk])
+        self.assertEqual(search.search_item_ids("passion tea"), [self.tea.pk])
+
+    def test_index_follows_changes(self):
+        self.cake.name = "Chocolate cake"
+        self.cake.save()
+        self.assertEqual(search.search_item_ids("chocolate"), [self.cake.pk])
+        self.cake.delete()
+        self.assertEqual(search.search_item_ids("chocolate"), [])
+
+    def test_filters_apply_before_the_limit(self):
+        Item.objects.filter(pk=self.juice.pk).update(available=False)
+        self.assertEqual(search.search_item_ids("pass", limit=1, available=True), [self.tea.pk])
+        self.assertEqual(search.search_item_ids("pass", category_id=self.juice.category_id), [self.juice.pk])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM orders_item_fts")
+        call_command('rebuild_search_index', stdout=mock.Mock())
+        self.assertEqual(search.search_item_ids("cake"), [self.cake.pk])
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("staff@example.com", "staff@example.com", "pw", is_staff=True)
+        self.orders = [Order.objects.create(full_name=f"Customer {i}", phone="1", address="x") for i in range(7)]
+        # Same timestamp for some rows, so the id tiebreaker matters.
+        Order.objects.filter(pk__in=[o.pk for o in self.orders[:4]]).update(created_at=self.orders[0].created_at)
+
+    def test_pages_cover_every_row_once(self):
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(Order.objects.all(), cursor, page_size=3)
+            seen += [o.pk for o in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sorted(seen), sorted(o.pk for o in self.orders))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_query_count_does_not_grow_with_table(self):
+        self.client.force_login(self.staff)
+        url = reverse('orders:order-dashboard') + '?page_size=2'
+        with self.assertNumQueries(3):  # session, user, page (sizes are columns on Order)
+            self.client.get(url)
+        response = self.client.get(url + '&format=json')
+        data = response.json()
+        self.assertIn("Customer 6", data['html'])
+        self.assertTrue(data['next_cursor'])
+
+
+def make_upload(name="photo.jpg", size=(900, 600)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, format="JPEG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+
+    def test_upload_through_form_generates_variants(self):
+        form = ItemForm({'name': "Samosa", 'price': "300", 'available': "on"}, {'image': make_upload()})
+        self.assertTrue(form.is_valid(), form.errors)
+        item = form.save()
+        item.refresh_from_db()
+        self.assertEqual(sorted(item.image_variants['jpeg'], key=int), ["120", "320", "640"])
+        for name in item.image_variants['jpeg'].values():
+            self.assertTrue(os.path.exists(os.path.join(self.media.name, name)))
+
+        response = self.client.get(reverse('orders:menu'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, ".jpg 320w")
+
+    def test_small_image_is_not_upscaled_and_backfill_fills_gaps(self):
+        item = Item.objects.create(name="Tea", price=200, image=make_upload("tea.jpg", (200, 100)))
+        self.assertEqual(item.image_variants, {})
+        call_command('generate_image_variants', stdout=io.StringIO())
+        item.refresh_from_db()
+        self.assertEqual(sorted(item.image_variants['webp'], key=int), ["120", "200"])
+        self.assertEqual(item.thumbnail_url, settings.MEDIA_URL + item.image_variants['jpeg']['120'])
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=self.media.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_identical_uploads_are_stored_once(self):
+        a = Item.objects.create(name="Chapati", price=200, image=make_upload("download_7.jpeg"))
+        b = Item.objects.create(name="Chapati 2", price=200, image=make_upload("download_7.jpeg"))
+        self.assertEqual(a.image.name, b.image.name)
+        self.assertTrue(is_hashed_name(a.image.name))
+        self.assertEqual(os.listdir(os.path.join(self.media.name, "items")), [os.path.basename(a.image.name)])
+
+        response = views.serve_media(RequestFactory().get("/"), a.image.name)
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_reupload_refreshes_the_grace_period(self):
+        # Saved but not yet referenced, as during an upload that hasn't committed.
+        storage = Item._meta.get_field('image').storage
+        name = storage.save("items/tea.jpg", make_upload("tea.jpg", (50, 50)))
+        os.utime(storage.path(name), (0, 0))
+        self.assertEqual(storage.save("items/tea.jpg", make_upload("tea.jpg", (50, 50))), name)
+        call_command('gc_item_images', grace_hours=1, stdout=io.StringIO())
+        self.assertTrue(storage.exists(name))
+
+    def test_gc_removes_only_unreferenced_files(self):
+        kept = Item.objects.create(name="Tea", price=200, image=make_upload("tea.jpg", (50, 50)))
+        gone = Item.objects.create(name="Cake", price=200, image=make_upload("cake.jpg", (60, 60)))
+        orphan = gone.image.name
+        gone.delete()
+
+        call_command('gc_item_images', grace_hours=0, stdout=io.StringIO())
+        storage = kept.image.storage
+        self.assertTrue(storage.exists(kept.image.name))
+        self.assertFalse(storage.exists(orphan))
+
+    def test_rehashed_images_reach_menu_api_deltas(self):
+        cache.clear()
+        os.makedirs(os.path.join(self.media.name, "items"))
+        with open(os.path.join(self.media.name, "items", "legacy.jpg"), "wb") as f:
+            f.write(make_upload().read())
+        item = Item.objects.create(name="Tea", price=200)
+        Item.objects.filter(pk=item.pk).update(image="items/legacy.jpg",
+                                               updated_at=timezone.now() - timedelta(minutes=5))
+        Item.objects.create(name="Cake", price=300)  # the version a client holds is newer than the tea
+        since = self.client.get(reverse('orders:menu-api')).json()['version']
+        delta = lambda: {i['id']: i['image'] for i in self.client.get(
+            reverse('orders:menu-api'), {'since': since}).json()['items']}
+        self.assertNotIn(item.pk, delta())
+
+        with self.captureOnCommitCallbacks(execute=True):  # the catalog version bump
+            call_command('gc_item_images', rehash=True, grace_hours=0, stdout=io.StringIO())
+        item.refresh_from_db()
+        self.assertTrue(is_hashed_name(item.image.name))
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, "items", "legacy.jpg")))
+        self.assertEqual(delta()[item.pk], item.image.url)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.item = Item.objects.create(name="Juice", price=500)
+
+    def test_unchanged_menu_is_304_without_queries(self):
+        self.client.get(reverse('orders:menu'))  # sets the CSRF cookie, which is part of the ETag
+        response = self.client.get(reverse('orders:menu'))
+        etag = response['ETag']
+        self.assertIn("private", response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('orders:menu'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.name = "Fresh juice"
+            self.item.save()
+        response = self.client.get(reverse('orders:menu'), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Fresh juice")
+
+    def test_cart_change_invalidates_item_detail(self):
+        user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(user)
+        url = reverse('orders:item-detail', args=[self.item.pk])
+        self.client.get(url)  # first render sets the CSRF cookie, which is part of the ETag
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.get(reverse('orders:cart-add', args=[self.item.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class MenuApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.drinks = Category.objects.create(name="Drinks")
+        self.juice = Item.objects.create(name="Juice", price=500, category=self.drinks)
+        self.tea = Item.objects.create(name="Tea", price=300)
+
+    def get(self, **params):
+        return self.client.get(reverse('orders:menu-api'), params)
+
+    def test_full_then_delta_sync(self):
+        data = self.get().json()
+        self.assertTrue(data['full'])
+        self.assertEqual([i['id'] for i in data['items']], [self.juice.pk, self.tea.pk])
+        self.assertEqual(data['items'][0], {
+            'id': self.juice.pk, 'name': "Juice", 'price': "500.00", 'available': True,
+            'category': self.drinks.pk, 'image': None, 'images': {},
+        })
+
+        # Push earlier writes outside the overlap window, then change one item and delete one.
+        Item.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        since = self.get().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.juice.price = 550
+            self.juice.save()
+            tea_id = self.tea.pk
+            self.tea.delete()
+        delta = self.get(since=since).json()
+        self.assertFalse(delta['full'])
+        self.assertEqual([(i['id'], i['price']) for i in delta['items']], [(self.juice.pk, "550.00")])
+        self.assertEqual(delta['deleted'], [tea_id])
+
+    def test_gzip_and_strong_etag(self):
+        response = self.client.get(reverse('orders:menu-api'), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertFalse(response['ETag'].startswith("W/"))
+        self.assertIn("Accept-Encoding", response['Vary'])
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('orders:menu-api'), HTTP_ACCEPT_ENCODING="gzip",
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.get(since="not-a-version").status_code, 400)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class StockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(self.user)
+        self.samosa = Item.objects.create(name="Samosa", price=300, stock=2)
+        cart_for(self.user).clear()
+
+    def test_last_units_flip_item_to_unavailable(self):
+        fill_cart(self.user, {str(self.samosa.pk): 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.client)
+        self.samosa.refresh_from_db()
+        self.assertEqual((self.samosa.stock, self.samosa.available), (0, False))
+        self.assertEqual(FirebaseSyncState.objects.get(path=f"items/{self.samosa.pk}").payload['available'], False)
+        self.assertNotContains(self.client.get(reverse('orders:menu')), "Samosa")
+
+    def test_oversell_rolls_back_the_order(self):
+        fill_cart(self.user, {str(self.samosa.pk): 3})
+        response = place_order(self.client)
+        self.assertRedirects(response, reverse('orders:view-cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.samosa.refresh_from_db()
+        self.assertEqual(self.samosa.stock, 2)
+
+    def test_add_to_cart_refuses_sold_out_item(self):
+        Item.objects.filter(pk=self.samosa.pk).update(stock=0, available=False)
+        response = self.client.get(reverse('orders:cart-add', args=[self.samosa.pk]))
+        self.assertRedirects(response, reverse('orders:menu'), fetch_redirect_response=False)
+        self.assertEqual(cart_for(self.user).get(), {})
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class CartResolutionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(self.user)
+        self.items = [Item.objects.create(name=f"Item {i}", price=100 + i) for i in range(5)]
+
+    def count_queries(self, url, cart):
+        fill_cart(self.user, cart)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant_in_cart_size(self):
+        for url in (reverse('orders:view-cart'), reverse('orders:checkout')):
+            one = self.count_queries(url, {str(self.items[0].pk): 1})
+            five = self.count_queries(url, {str(item.pk): 2 for item in self.items})
+            self.assertEqual(one, five, url)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class OrderCreationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(self.user)
+        self.items = [Item.objects.create(name=f"Item {i}", price=100 + i, stock=10) for i in range(5)]
+        FirebaseOutbox.objects.all().delete()
+
+    def checkout(self, cart, commit=False):
+        fill_cart(self.user, cart)
+        form = {'full_name': "Ann", 'phone': "0780000000", 'address': "Block A"}
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=commit):
+            response = self.client.post(reverse('orders:checkout'), form)
+        return response, len(ctx.captured_queries)
+
+    def test_checkout_query_count_is_constant_in_cart_size(self):
+        # With the commit hooks run and a dashboard open, so the live event's render counts too.
+        with mock.patch.object(live.get_broker(), 'has_subscribers', return_value=True):
+            _, one = self.checkout({str(self.items[0].pk): 1}, commit=True)
+            _, five = self.checkout({str(item.pk): 2 for item in self.items}, commit=True)
+        self.assertEqual(one, five)
+        order = Order.objects.latest('pk')
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(order.total_price, sum(2 * item.price for item in self.items))
+
+    def test_whole_order_is_one_firebase_write(self):
+        response, _ = self.checkout({str(self.items[0].pk): 1, str(self.items[1].pk): 3})
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('orders:order-success', args=[order.pk]),
+                             fetch_redirect_response=False)
+        write = FirebaseOutbox.objects.get()
+        self.assertEqual(write.path, f"orders/{order.pk}")
+        self.assertEqual(sorted(line['quantity'] for line in write.payload['items'].values()), [1, 3])
+        # Later saves of the order or a line only send what changed.
+        order.status = 'preparing'
+        order.save()
+        order.items.first().save()
+        self.assertEqual(sorted(FirebaseOutbox.objects.values_list('path', flat=True)),
+                         [f"orders/{order.pk}", f"orders/{order.pk}/status"])
+
+    def test_order_sizes_are_stored_and_recalculated_in_the_database(self):
+        self.checkout({str(self.items[0].pk): 2, str(self.items[1].pk): 3})
+        order = Order.objects.get()
+        self.assertEqual((order.line_count, order.item_count, order.total_price), (2, 5, Decimal("503")))
+        order.items.filter(item=self.items[1]).update(quantity=1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(order.calculate_total(), Decimal("301"))
+        self.assertEqual((order.line_count, order.item_count), (2, 3))
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'orders_orderitem' in q['sql']
+                          and 'UPDATE' not in q['sql']])
+        self.assertEqual(FirebaseOutbox.objects.filter(path=f"orders/{order.pk}/total_price").count(), 1)
+
+        # The stored total and its Firebase write commit or roll back together.
+        order.items.filter(item=self.items[1]).update(quantity=2)
+        with mock.patch.object(Order, '_queue_firebase_sync', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                order.calculate_total()
+        self.assertEqual(Order.objects.get().total_price, Decimal("301"))
+
+    def test_order_dashboard_does_not_load_lines(self):
+        self.checkout({str(self.items[0].pk): 2})
+        self.user.is_staff = True
+        self.user.save()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('orders:order-dashboard'))
+        self.assertContains(response, "<td>2</td>")
+        self.assertFalse([q for q in ctx.captured_queries if 'orders_orderitem' in q['sql']])
+
+    def test_resubmitted_checkout_returns_the_first_order(self):
+        fill_cart(self.user, {str(self.items[0].pk): 2})
+        key = self.client.get(reverse('orders:checkout')).context['form'].initial['idempotency_key']
+        form = {'full_name': "Ann", 'phone': "0780000000", 'address': "Block A", 'idempotency_key': key}
+        first = self.client.post(reverse('orders:checkout'), form)
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.post(reverse('orders:checkout'), form)
+        order = Order.objects.get()
+        self.assertEqual(order.idempotency_key, key)
+        self.assertEqual(first.url, again.url)
+        self.assertRedirects(again, reverse('orders:order-success', args=[order.pk]), fetch_redirect_response=False)
+        self.assertEqual(len(ctx.captured_queries), 3)  # session, user, order by key
+        self.assertEqual(FirebaseOutbox.objects.count(), 1)
+
+    def test_quick_order_needs_the_cart_pages_key(self):
+        fill_cart(self.user, {str(self.items[0].pk): 2})
+        self.assertEqual(self.client.get(reverse('orders:place-order')).status_code, 405)
+        self.client.post(reverse('orders:place-order'))
+        self.assertFalse(Order.objects.exists())
+
+        key = self.client.get(reverse('orders:view-cart')).context['idempotency_key']
+        self.client.post(reverse('orders:place-order'), {'idempotency_key': key})
+        fill_cart(self.user, {str(self.items[0].pk): 2})  # as if the first tap hadn't cleared it yet
+        self.client.post(reverse('orders:place-order'), {'idempotency_key': key})
+        self.assertEqual(Order.objects.get().idempotency_key, key)
+
+    def test_concurrent_duplicate_loses_on_the_unique_key(self):
+        key = new_idempotency_key()
+        fill_cart(self.user, {str(self.items[0].pk): 2})
+        cart = resolve_cart(cart_for(self.user).get())
+        first, created = create_order(Order(user=self.user, idempotency_key=key), cart)
+        self.assertTrue(created)
+        # The second request got past the submitted_order() check before the first committed.
+        second, created = create_order(Order(user=self.user, idempotency_key=key), cart)
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Item.objects.get(pk=self.items[0].pk).stock, 8)
+
+    def test_failure_partway_writes_nothing(self):
+        fill_cart(self.user, {str(self.items[0].pk): 1, str(self.items[1].pk): 11})
+        response = place_order(self.client)
+        self.assertRedirects(response, reverse('orders:view-cart'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('orders:view-cart')), "Item 1")
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(FirebaseOutbox.objects.exists())
+        self.assertEqual(list(Item.objects.values_list('stock', flat=True).order_by('pk')[:2]), [10, 10])
+
+    def test_deleted_item_is_dropped_not_404(self):
+        gone = self.items.pop()
+        fill_cart(self.user, {str(self.items[0].pk): 2, str(gone.pk): 1, "junk": 1})
+        gone.delete()
+        response = self.client.get(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_price'], 2 * self.items[0].price)
+        self.assertEqual(cart_for(self.user).get(), {str(self.items[0].pk): 2})
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class CartStoreTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(self.user)
+        self.tea = Item.objects.create(name="Tea", price=200)
+        self.cake = Item.objects.create(name="Cake", price=800)
+        cart_for(self.user).clear()
+
+    def add(self, item):
+        return self.client.post(reverse('orders:cart-update'), {'add': {item.pk: 1}},
+                                content_type='application/json').json()['cart_quantity']
+
+    def test_add_to_cart_does_not_write_the_session(self):
+        self.add(self.tea)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.add(self.tea), 2)
+        self.assertFalse([q for q in ctx.captured_queries if 'django_session' in q['sql']
+                          and not q['sql'].startswith('SELECT')])
+
+    def test_every_store_keeps_lines(self):
+        for store in ('cache', 'cookie', 'session'):
+            with self.subTest(store=store), override_settings(CART={'STORE': store, 'CACHE': 'carts'}):
+                self.client.cookies.pop('cart', None)
+                self.add(self.tea)
+                self.add(self.tea)
+                self.assertEqual(self.add(self.cake), 3)
+                self.client.post(reverse('orders:cart-remove', args=[self.tea.pk]))
+                response = self.client.get(reverse('orders:view-cart'))
+                self.assertEqual([(l.item.name, l.quantity) for l in response.context['cart_items']],
+                                 [("Cake", 1)])
+                place_order(self.client)
+                self.assertEqual(self.client.get(reverse('orders:view-cart')).context['cart_items'], [])
+
+    def test_every_store_keeps_the_summary_in_step(self):
+        for store in ('cache', 'cookie', 'session'):
+            with self.subTest(store=store), override_settings(CART={'STORE': store, 'CACHE': 'carts'}):
+                self.client.cookies.pop('cart', None)
+                update = lambda changes: self.client.post(
+                    reverse('orders:cart-update'), changes, content_type='application/json')
+                update({'add': {self.tea.pk: 2, self.cake.pk: 1}})
+                update({'add': {self.tea.pk: 1}, 'set': {self.cake.pk: 2}})
+                summary = self.client.get(reverse('orders:view-cart')).context['cart_summary']
+                self.assertEqual((summary.lines, summary.quantity, summary.total), (2, 5, Decimal("2200")))
+                update({'remove': [self.cake.pk]})
+                summary = self.client.get(reverse('orders:view-cart')).context['cart_summary']
+                self.assertEqual((summary.lines, summary.quantity, summary.total), (1, 3, Decimal("600")))
+                place_order(self.client)
+                summary = self.client.get(reverse('orders:view-cart')).context['cart_summary']
+                self.assertEqual((summary.lines, summary.quantity, summary.total), (0, 0, Decimal("0")))
+
+    def test_adding_nothing_leaves_the_cart_empty(self):
+        for store in ('cache', 'cookie', 'session'):
+            with self.subTest(store=store), override_settings(CART={'STORE': store, 'CACHE': 'carts'}):
+                self.client.cookies.pop('cart', None)
+                response = self.client.post(reverse('orders:cart-update'), {'add': {self.tea.pk: 0}},
+                                            content_type='application/json')
+                self.assertEqual(response.json()['cart_quantity'], 0)
+                summary = self.client.get(reverse('orders:view-cart')).context['cart_summary']
+                self.assertEqual((summary.lines, summary.quantity), (0, 0))
+
+    @override_settings(CART=dict(CACHE_CART, TIMEOUT=100))
+    def test_cache_cart_expires_as_one(self):
+        cart = cart_for(self.user)
+        with mock.patch('time.time', return_value=1000.0) as now:
+            cart.set(self.tea.pk, 1, self.tea.price)
+            now.return_value = 1060.0
+            cart.add(self.cake.pk, 1, self.cake.price)
+            now.return_value = 1130.0  # past the first write's timeout, within the last one's
+            self.assertEqual(cart.get(), {str(self.tea.pk): 1, str(self.cake.pk): 1})
+            self.assertEqual(cart.summary(), CartSummary(2, 2, Decimal("1000")))
+            now.return_value = 1161.0
+            self.assertEqual(cart.get(), {})
+
+    def test_dashboard_pages_never_read_the_cart(self):
+        self.user.is_staff = True
+        self.user.save()
+        with mock.patch.object(CacheCartStore, 'summary') as summary:
+            response = self.client.get(reverse('dashboard-home'))
+        self.assertEqual(response.status_code, 200)
+        summary.assert_not_called()
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class BulkCartUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.client.force_login(self.user)
+        self.tea = Item.objects.create(name="Tea", price=200)
+        self.juice = Item.objects.create(name="Juice", price=500, stock=3)
+        self.cake = Item.objects.create(name="Cake", price=800)
+        fill_cart(self.user, {str(self.cake.pk): 1})
+
+    def update(self, changes):
+        return self.client.post(reverse('orders:cart-update'), changes, content_type='application/json')
+
+    def test_batch_of_changes_in_one_request(self):
+        data = self.update({'add': {self.tea.pk: 5}, 'set': {self.juice.pk: 2}, 'remove': [self.cake.pk]}).json()
+        self.assertEqual(data['errors'], {})
+        self.assertEqual(data['cart_quantity'], 7)
+        self.assertEqual(data['total'], "2000.00")
+        self.assertEqual(cart_for(self.user).get(), {str(self.tea.pk): 5, str(self.juice.pk): 2})
+
+    def test_stock_limits_reject_only_that_line(self):
+        data = self.update({'add': {self.juice.pk: 4, self.tea.pk: 1}}).json()
+        self.assertEqual(list(data['errors']), [str(self.juice.pk)])
+        self.assertEqual(cart_for(self.user).get(), {str(self.cake.pk): 1, str(self.tea.pk): 1})
+
+    def test_form_post_and_bad_input(self):
+        response = self.client.post(reverse('orders:cart-update'), {f'add-{self.tea.pk}': "2"})
+        self.assertEqual(response.json()['cart_quantity'], 3)
+        self.assertEqual(self.update({'add': {self.tea.pk: -1}}).status_code, 400)
+        for pk in ("99999999999999999999999", "0", "-3"):
+            self.assertEqual(self.update({'add': {pk: 1}}).status_code, 400)
+        self.assertEqual(self.update({'remove': ["99999999999999999999999"]}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.update({'add': {self.tea.pk: 1}}).status_code, 401)
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'}, CART=CACHE_CART)
+class LiveOrderFeedTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("kitchen", "k@example.com", "pw", is_staff=True)
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        self.item = Item.objects.create(name="Chapati", price=150)
+
+    def test_order_changes_publish_one_event_each_after_commit(self):
+        self.client.force_login(self.user)
+        fill_cart(self.user, {str(self.item.pk): 2})
+        with mock.patch.object(live, 'publish') as publish, \
+                mock.patch.object(live.get_broker(), 'has_subscribers', return_value=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                place_order(self.client)
+            order = Order.objects.get()
+            order_id = order.pk
+            with self.captureOnCommitCallbacks(execute=True):
+                order.status = 'preparing'
+                order.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.get().save()
+            with self.captureOnCommitCallbacks(execute=True):
+                order.delete()
+        events = [call.args[0] for call in publish.call_args_list]
+        self.assertEqual([(e['type'], e['id']) for e in events],
+                         [('created', order_id), ('status', order_id), ('updated', order_id), ('deleted', order_id)])
+        self.assertIn(f'data-order-id="{order_id}"', events[0]['rows']['dashboard'])
+        self.assertIn("Chapati", events[1]['rows']['manage'])
+
+    def test_nothing_is_rendered_without_subscribers(self):
+        order = Order.objects.create(full_name="Ann", phone="0", address="-")
+        with mock.patch.object(live, 'order_event') as order_event, self.assertNumQueries(0):
+            live.publish_order(order, 'status')
+        order_event.assert_not_called()
+
+    async def test_dashboard_stream_delivers_published_events(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('orders:order-events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b"retry:"))
+        reading = asyncio.ensure_future(anext(stream))
+        while not live.get_broker()._subscribers:
+            await asyncio.sleep(0.01)
+        # Published from another thread, as a WSGI worker's on_commit would.
+        await asyncio.to_thread(live.publish, {'type': 'status', 'id': 7, 'status': 'delivered', 'rows': {}})
+        chunk = await asyncio.wait_for(reading, 5)
+        self.assertEqual(chunk.decode().split("\n")[:2], ["event: order", 'data: {"type": "status", "id": 7, '
+                                                           '"status": "delivered", "rows": {}}'])
+        # A client disconnect cancels the stream, which unsubscribes it.
+        reading = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        reading.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reading
+        self.assertFalse(live.get_broker()._subscribers)
+
+    def test_feed_is_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('orders:order-events')).status_code, 302)
+
+    def test_wsgi_dashboards_fall_back_to_reloads(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('orders:order-events')).status_code, 204)
+        for name in ('orders:order-dashboard', 'orders:manage-orders'):
+            self.assertNotContains(self.client.get(reverse(name)), "EventSource")
+
+    async def test_asgi_dashboards_follow_the_feed(self):
+        await self.async_client.aforce_login(self.staff)
+        for name in ('orders:order-dashboard', 'orders:manage-orders'):
+            self.assertContains(await self.async_client.get(reverse(name)), "EventSource")
+
+
+@override_settings(FIREBASE={'DISPATCH': 'worker'})
+class OrderIndexTests(TestCase):
+    """The hot order queries are answered from their composite indexes, not a scan and sort."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user("kitchen", "k@example.com", "pw", is_staff=True)
+        self.user = User.objects.create_user("a@example.com", "a@example.com", "pw")
+        # Like a real canteen: most orders are long finished
+        statuses = ['delivered'] * 40 + ['cancelled'] * 5 + ['pending', 'pending', 'preparing']
+        Order.objects.bulk_create(Order(user=self.user, full_name="Ann", phone="1", address="A", status=status)
+                                  for status in statuses)
+        self.order = Order.objects.first()
+        Payment.objects.create(order=self.order, method="momo", amount=100)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")  # SQLite only weighs a partial index against others with statistics
+
+    def plan_for(self, url, table):
+        """EXPLAIN QUERY PLAN of the query `url` runs against `table`."""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        sql = next(q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('SELECT') and f'FROM "{table}"' in q['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return " ".join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, plan, index):
+        self.assertIn(f"USING INDEX {index}", plan)
+        self.assertNotIn("TEMP B-TREE", plan)  # no separate sort step
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite's")
+    def test_order_lists_use_composite_indexes(self):
+        self.client.force_login(self.user)
+        self.assertUsesIndex(self.plan_for(reverse('orders:view-orders'), 'orders_order'), 'order_user_recent_idx')
+        self.client.force_login(self.staff)
+        dashboard = reverse('orders:order-dashboard')
+        self.assertUsesIndex(self.plan_for(dashboard + '?status=delivered', 'orders_order'),
+                             'order_status_recent_idx')
+        self.assertUsesIndex(self.plan_for(dashboard + '?status=active', 'orders_order'),
+                             'order_active_recent_idx')
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite's")
+    def test_order_success_payment_lookup_uses_index(self):
+        self.client.force_login(self.user)
+        plan = self.plan_for(reverse('orders:order-success', args=[self.order.pk]), 'orders_payment')
+        self.assertUsesIndex(plan, 'payment_order_recent_idx')
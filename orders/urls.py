@@ -9,11 +9,14 @@ urlpatterns = [
     path('', views.menu, name='menu-list'),
     path('menu/', views.menu, name='menu'),
     path('item/<int:item_id>/', views.item_detail, name='item-detail'),
+    path('category/<int:category_id>/', views.category_items, name='category-items'),
+    path('api/menu/', views.menu_api, name='menu-api'),
 
     # Cart
     path('cart/', views.view_cart, name='cart'),
     path('cart/', views.view_cart, name='view-cart'),
     path('cart/add/<int:item_id>/', views.add_to_cart, name='cart-add'),
+    path('cart/update/', views.update_cart, name='cart-update'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='cart-remove'),
 
     # Orders
@@ -35,6 +38,8 @@ urlpatterns = [
 # ========================
 path('dashboard/', views.dashboard_home, name='dashboard-home'),  # Main admin dashboard
 path('dashboard/orders/', views.order_dashboard, name='order-dashboard'),  # All orders
+path('dashboard/orders/events/', views.order_events, name='order-events'),  # Live order feed (SSE)
+path('dashboard/firebase-sync/', views.firebase_sync_status, name='firebase-sync-status'),
 path('dashboard/item/add/', views.add_item, name='add-item'),
 path('dashboard/item/edit/<int:item_id>/', views.edit_item, name='edit-item'),
 path('dashboard/item/delete/<int:item_id>/', views.delete_item, name='delete-item'),
@@ -1,12 +1,37 @@
-from django.shortcuts import render, get_object_or_404, redirect
+import hashlib
+import json
+import re
+
+from django.shortcuts import render, get_object_or_404, redirect, resolve_url
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse
-from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Item, Category, Order
+from django.utils.functional import SimpleLazyObject
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.text import compress_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import condition, require_POST
+from django.views.static import serve
+from . import live
+from .cart import apply_cart_changes, resolve_cart
+from .catalog import (
+    catalog_context, catalog_version, decode_sync_version, get_categories, get_menu_page,
+    menu_snapshot, needs_full_sync,
+)
+from .ordering import create_order, new_idempotency_key, parse_idempotency_key, submitted_order
+from .pagination import keyset_paginate, page_size_from
+from .stock import OutOfStock
+from .storage import is_hashed_name
+from .models import ACTIVE_ORDER_STATUSES, Item, Category, Order
 from .forms import ItemForm, LoginForm, OrderForm, CustomUserCreationForm
 from django.contrib.admin.views.decorators import staff_member_required
 from .models import Order, Item
@@ -22,125 +47,272 @@ from django.contrib.auth.decorators import user_passes_test
 # MENU & CATEGORY DISPLAY
 # ============================
 
+def _paginated(request, template, rows_template, context):
+    """
+    Render a list page, or with ?format=json just the next page's rows plus
+    the cursor after them (used for "Load more" / infinite scroll).
+    """
+    if request.GET.get('format') == 'json':
+        page = context['page']
+        html = render_to_string(rows_template, context, request=request)
+        return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+    return render(request, template, context)
+
+
+def _live_orders(request):
+    """
+    Whether the order dashboards can follow the live feed (order_events):
+    only under ASGI, where a stream costs a coroutine and is sent as written.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    ETag for a catalog page as this visitor sees it: the catalog version
+    plus everything per-user the page shows (nav, cart badge, CSRF token,
+    pending flash messages). Costs no queries beyond loading the session,
+    so a matching If-None-Match gets a 304 before any item query or
+    template render.
+    """
+    state = (
+        catalog_version(),
+        request.get_full_path(),
+        request.user.pk,
+        request.user.is_staff,
+        request.cart.summary(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        len(messages.get_messages(request)),
+    )
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def catalog_conditional(view):
+    # Browsers must revalidate, and shared caches must not store per-user pages.
+    # The CSRF cookie is for the add-to-cart script (the cached cards carry no token).
+    view = cache_control(private=True, no_cache=True)(condition(etag_func=catalog_etag)(view))
+    return ensure_csrf_cookie(view)
+
+
+@catalog_conditional
 def menu(request):
-    categories = Category.objects.all()
-    items = Item.objects.all()
-    query = request.GET.get('q')
-    if query:
-        items = items.filter(Q(name__icontains=query) | Q(description__icontains=query))
-    return render(request, 'orders/menu_list.html', {'categories': categories, 'items': items})
+    query = request.GET.get('q', '').strip()
+    cursor = request.GET.get('cursor')
+    page_size = page_size_from(request)
+    # Only evaluated when the cached grid fragment has to be re-rendered
+    page = SimpleLazyObject(lambda: get_menu_page(query, cursor=cursor, page_size=page_size))
+    return _paginated(request, 'orders/menu_list.html', 'orders/_item_cards.html', {
+        'categories': SimpleLazyObject(get_categories),
+        'page': page,
+        'query': query,
+        'cursor': cursor or '',
+        'page_size': page_size,
+        **catalog_context(),
+    })
 
 
+@catalog_conditional
 def category_items(request, category_id):
-    category = get_object_or_404(Category, id=category_id)
-    items = Item.objects.filter(category=category)
-    return render(request, 'orders/category_items.html', {'category': category, 'items': items})
+    category = next((c for c in get_categories() if c.id == category_id), None)
+    if category is None:
+        raise Http404("No category matches the given query.")
+    cursor = request.GET.get('cursor')
+    page_size = page_size_from(request)
+    page = SimpleLazyObject(
+        lambda: get_menu_page(category_id=category_id, cursor=cursor, page_size=page_size)
+    )
+    return _paginated(request, 'orders/category_items.html', 'orders/_item_cards.html', {
+        'category': category,
+        'categories': get_categories(),
+        'page': page,
+        'cursor': cursor or '',
+        'page_size': page_size,
+        **catalog_context(),
+    })
+
 
+def serve_media(request, path):
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_hashed_name(path):
+        # Content-addressed: the bytes behind this URL can never change
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
+
+@catalog_conditional
 def item_detail(request, item_id):
     item = get_object_or_404(Item, id=item_id)
     return render(request, 'orders/item_detail.html', {'item': item})
 
 
+@cache_control(public=True, no_cache=True)
+def menu_api(request):
+    """
+    Read-only JSON catalog for kiosk and mobile clients. Pass the returned
+    "version" back as ?since= to get only what changed (and "deleted" ids).
+    """
+    since = request.GET.get('since') or None
+    try:
+        since_at = decode_sync_version(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': "Invalid 'since' version."}, status=400)
+
+    # Strong ETag per encoding: the gzip and identity bodies differ byte-wise.
+    gzip = bool(re.search(r'\bgzip\b', request.headers.get('Accept-Encoding', '')))
+    state = (catalog_version(), since, needs_full_sync(since_at))
+    etag = '"%s%s"' % (hashlib.md5(repr(state).encode()).hexdigest(), '-gzip' if gzip else '')
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        body = json.dumps(menu_snapshot(since_at), cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        response = HttpResponse(compress_string(body) if gzip else body, content_type='application/json')
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
 # ============================
-# CART FUNCTIONALITY (session-based)
+# CART FUNCTIONALITY (see cart_store.py)
 # ============================
 
-def _get_cart(request):
-    """Return the cart dictionary from session, or create if missing."""
-    return request.session.setdefault('cart', {})
+def _resolve_cart(request):
+    """Priced cart lines (one query); ids of deleted items are dropped from the cart."""
+    resolved = resolve_cart(request.cart.get())
+    for key in resolved.stale:
+        request.cart.remove(key)
+    return resolved
+
+
+MAX_ITEM_ID = 2 ** 63 - 1  # BigAutoField
+
+
+def _item_id(value):
+    """A submitted item id as the cart's str key; ValueError unless it could be a real id."""
+    pk = int(value)
+    if not 0 < pk <= MAX_ITEM_ID:
+        raise ValueError(value)  # larger ones overflow the database driver
+    return str(pk)
+
+
+def _quantity(value, default=1):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return default
 
 
 @login_required
 def add_to_cart(request, item_id):
-    """Add item to cart. Supports AJAX for live cart count."""
+    """Add item(s) to cart. Plain-link fallback; the menu script uses update_cart."""
     item = get_object_or_404(Item, id=item_id)
-    cart = _get_cart(request)
-    key = str(item_id)
-    cart[key] = cart.get(key, 0) + 1
-    request.session.modified = True
-    messages.success(request, f"{item.name} added to your cart.")
+    quantity = _quantity(request.POST.get('quantity') or request.GET.get('quantity')) or 1
+    errors = apply_cart_changes(request.cart, add={item_id: quantity})
+    if errors:
+        messages.warning(request, errors[str(item_id)])
+    else:
+        messages.success(request, f"{item.name} added to your cart.")
+    return redirect('orders:menu')
 
-    # Return JSON if AJAX request
-    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        total_quantity = sum(cart.values())
-        return JsonResponse({'cart_quantity': total_quantity})
 
-    return redirect('orders:menu')
+@require_POST
+def update_cart(request):
+    """
+    Apply several cart changes in one request and return the cart summary.
+    JSON body: {"add": {item_id: n}, "set": {item_id: n}, "remove": [item_id]};
+    or form fields add-<id>=n, set-<id>=n and remove=<id>.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in first.", 'login_url': resolve_url(settings.LOGIN_URL)},
+                            status=401)
+    try:
+        if request.content_type == 'application/json':
+            changes = json.loads(request.body)
+        else:
+            changes = {'add': {}, 'set': {}, 'remove': request.POST.getlist('remove')}
+            for name, value in request.POST.items():
+                op, _, pk = name.partition('-')
+                if op in ('add', 'set') and pk:
+                    changes[op][pk] = value
+        add = {_item_id(pk): int(n) for pk, n in changes.get('add', {}).items()}
+        set_ = {_item_id(pk): int(n) for pk, n in changes.get('set', {}).items()}
+        remove = [_item_id(pk) for pk in changes.get('remove', [])]
+        if any(n < 0 for n in [*add.values(), *set_.values()]):
+            raise ValueError("negative quantity")
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': "Malformed cart update."}, status=400)
+
+    errors = apply_cart_changes(request.cart, add=add, set=set_, remove=remove)
+    return JsonResponse({**_resolve_cart(request).summary(), 'errors': errors})
 
 
 @login_required
 def view_cart(request):
     """View cart page."""
-    cart = _get_cart(request)
-    cart_items = []
-    total_price = 0
-    for item_id_str, qty in cart.items():
-        try:
-            product = Item.objects.get(pk=int(item_id_str))
-        except Item.DoesNotExist:
-            continue
-        subtotal = product.price * qty
-        total_price += subtotal
-        cart_items.append({'item': product, 'quantity': qty, 'subtotal': subtotal})
-    return render(request, 'orders/cart.html', {'cart_items': cart_items, 'total': total_price})
+    cart = _resolve_cart(request)
+    return render(request, 'orders/cart.html', {
+        'cart_items': cart.lines, 'total': cart.total,
+        'idempotency_key': new_idempotency_key(),  # for the quick order form (place_order)
+    })
 
 
 @login_required
 def remove_from_cart(request, item_id):
     """Remove an item from cart."""
-    cart = _get_cart(request)
-    key = str(item_id)
-    if key in cart:
-        del cart[key]
-        request.session.modified = True
+    if str(item_id) in request.cart.get():
+        request.cart.remove(item_id)
         messages.success(request, "Item removed from your cart.")
     return redirect('orders:view-cart')
 
 
-def cart_count(request):
-    """Context processor to provide cart quantity to all templates."""
-    cart = request.session.get('cart', {})
-    total_quantity = sum(cart.values())
-    return {'cart_quantity': total_quantity}
-
-
 
 # ============================
 # ORDER FUNCTIONALITY
 # ============================
 
 @login_required
+@require_POST
 def place_order(request):
-    cart = _get_cart(request)
+    """
+    Quick order from the cart page, without delivery details. The form
+    carries the idempotency key view_cart issued, so repeated taps place
+    one order.
+    """
+    key = parse_idempotency_key(request.POST.get('idempotency_key'))
+    if key is None:
+        messages.warning(request, "Please place your order from the cart page.")
+        return redirect('orders:view-cart')
+    if submitted_order(request.user, key):
+        return redirect('orders:view-orders')  # a repeated submission
+
+    cart = _resolve_cart(request)
     if not cart:
         messages.warning(request, "Your cart is empty.")
         return redirect('orders:menu')
 
-    order = Order.objects.create(user=request.user, full_name=request.user.username, phone='N/A', address='N/A')
-
-    total = 0
-    from .models import OrderItem
-    for item_id_str, qty in cart.items():
-        try:
-            product = Item.objects.get(pk=int(item_id_str))
-        except Item.DoesNotExist:
-            continue
-        total += product.price * qty
-        OrderItem.objects.create(order=order, item=product, quantity=qty, price=product.price)
-
-    order.total_price = total
-    order.save()
-    request.session['cart'] = {}
-    request.session.modified = True
+    order = Order(user=request.user, full_name=request.user.username, phone='N/A', address='N/A',
+                  idempotency_key=key)
+    try:
+        order, created = create_order(order, cart)
+    except OutOfStock as e:
+        messages.error(request, str(e))
+        return redirect('orders:view-cart')
+    if not created:
+        return redirect('orders:view-orders')
+    request.cart.clear()
     messages.success(request, "Order placed successfully!")
     return redirect('orders:view-orders')
 
 
 @login_required
 def view_orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    orders = Order.objects.filter(user=request.user).prefetch_related('items__item')
+    page = keyset_paginate(orders, request.GET.get('cursor'), page_size_from(request))
+    return _paginated(request, 'orders/order_list.html', 'orders/_order_cards.html', {
+        'orders': page, 'page': page,
+    })
 
 
 @login_required
@@ -148,7 +320,7 @@ def cancel_order(request, order_id):
     if request.method != 'POST':
         return redirect('orders:order-list')
     order = get_object_or_404(Order, pk=order_id, user=request.user)
-    if order.status in ['pending', 'preparing']:
+    if order.status in ACTIVE_ORDER_STATUSES:
         order.status = 'cancelled'
         order.save()
         messages.success(request, f"Order #{order.id} has been cancelled.")
@@ -158,9 +330,26 @@ def cancel_order(request, order_id):
 
 
 
+def _filter_status(orders, request):
+    """
+    ?status=<status>, or ?status=active for pending and preparing orders,
+    for the staff order lists. Returns (orders, the filter applied or '').
+    """
+    status = request.GET.get('status', '')
+    if status == 'active':
+        return orders.filter(status__in=ACTIVE_ORDER_STATUSES), status
+    if status in dict(Order.STATUS_CHOICES):
+        return orders.filter(status=status), status
+    return orders, ''
+
+
 def manage_orders(request):
-    orders = Order.objects.all().order_by('-id')
-    return render(request, 'orders/manage_orders.html', {'orders': orders})
+    orders, status = _filter_status(Order.objects.select_related('user').prefetch_related('items__item'), request)
+    page = keyset_paginate(orders, request.GET.get('cursor'), page_size_from(request))
+    return _paginated(request, 'orders/manage_orders.html', 'orders/_manage_order_rows.html', {
+        'orders': page, 'page': page, 'status_filter': status, 'status_choices': Order.STATUS_CHOICES,
+        'live_orders': _live_orders(request),
+    })
 
 
 
@@ -228,46 +417,38 @@ def logout_user(request):
 
 @login_required
 def checkout(request):
-    cart = _get_cart(request)
+    if request.method == 'POST':
+        existing = submitted_order(request.user, request.POST.get('idempotency_key'))
+        if existing:  # a double tap or retry of a form that already went through
+            return redirect('orders:order-success', order_id=existing.id)
+
+    cart = _resolve_cart(request)
     if not cart:
         messages.warning(request, "Your cart is empty.")
         return redirect('orders:menu')
 
-    cart_items = []
-    total_price = 0
-    for item_id_str, qty in cart.items():
-        product = get_object_or_404(Item, pk=int(item_id_str))
-        subtotal = product.price * qty
-        total_price += subtotal
-        cart_items.append({'item': product, 'quantity': qty, 'subtotal': subtotal})
-
     if request.method == 'POST':
         form = OrderForm(request.POST)
         if form.is_valid():
             order = form.save(commit=False)
             order.user = request.user
-            order.total_price = total_price
-            order.save()
+            try:
+                order, created = create_order(order, cart)
+            except OutOfStock as e:
+                messages.error(request, str(e))
+                return redirect('orders:view-cart')
+            if not created:
+                return redirect('orders:order-success', order_id=order.id)
 
-            from .models import OrderItem
-            for row in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    item=row['item'],
-                    quantity=row['quantity'],
-                    price=row['item'].price,
-                )
-
-            request.session['cart'] = {}
-            request.session.modified = True
+            request.cart.clear()
             messages.success(request, f"Order #{order.id} placed successfully!")
             return redirect('orders:order-success', order_id=order.id)
     else:
-        form = OrderForm(initial={'full_name': request.user.username})
+        form = OrderForm(initial={'full_name': request.user.username, 'idempotency_key': new_idempotency_key()})
 
     return render(request, 'orders/checkout.html', {
-        'cart_items': cart_items,
-        'total_price': total_price,
+        'cart_items': cart.lines,
+        'total_price': cart.total,
         'form': form,
     })
 
@@ -291,9 +472,11 @@ def order_success(request, order_id):
 
 @staff_member_required
 def dashboard_home(request):
-    items = Item.objects.all().order_by('-created_at')
-    orders = Order.objects.prefetch_related('items__item').order_by('-created_at')
-    return render(request, 'dashboard/dashboard.html', {'items': items, 'orders': orders})
+    items = Item.objects.select_related('category')
+    page = keyset_paginate(items, request.GET.get('cursor'), page_size_from(request))
+    return _paginated(request, 'dashboard/dashboard.html', 'dashboard/_item_rows.html', {
+        'items': page, 'page': page,
+    })
 
     
     
@@ -335,8 +518,49 @@ def delete_item(request, item_id):
 
 @staff_member_required
 def order_dashboard(request):
-    orders = Order.objects.prefetch_related('items__item').order_by('-created_at')
-    return render(request, 'dashboard/order_dashboard.html', {'orders': orders})
+    # Sizes come from Order.line_count / item_count, so the lines aren't loaded
+    orders, status = _filter_status(Order.objects.select_related('user'), request)
+    page = keyset_paginate(orders, request.GET.get('cursor'), page_size_from(request))
+    return _paginated(request, 'dashboard/order_dashboard.html', 'dashboard/_order_rows.html', {
+        'orders': page, 'page': page, 'status_filter': status, 'status_choices': Order.STATUS_CHOICES,
+        'live_orders': _live_orders(request),
+    })
+
+
+@staff_member_required
+async def order_events(request):
+    """
+    Server-Sent Events feed of order changes (orders/live.py) for the order
+    dashboards, which patch their rows from it instead of reloading.
+    """
+    if not _live_orders(request):
+        # A WSGI worker would hold the stream's thread and buffer it forever;
+        # 204 tells EventSource to stop reconnecting.
+        return HttpResponse(status=204)
+    keepalive = settings.LIVE_ORDERS.get('KEEPALIVE', 15)
+
+    async def stream():
+        yield f"retry: {settings.LIVE_ORDERS.get('RETRY_MS', 3000)}\n\n"
+        async with live.get_broker().subscribe() as subscription:
+            while True:
+                event = await subscription.get(keepalive)
+                if event is None:
+                    yield ": keepalive\n\n"  # keeps proxies from closing an idle stream
+                else:
+                    yield f"event: order\ndata: {json.dumps(event)}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: send each event as it is written
+    return response
+
+
+@staff_member_required
+def firebase_sync_status(request):
+    """Firebase client counters and outbox backlog, for monitoring."""
+    from .firebase_client import get_client
+    from .outbox import backlog
+    return JsonResponse({'client': get_client().stats(), 'outbox': backlog()})
 
 # ==========================
 # Admin: Update / Delete Order
@@ -370,7 +594,11 @@ def delete_order(request, order_id):
 def manage_users(request):
     """Display all users and allow promotion to admin."""
     users = User.objects.exclude(is_superuser=True)  # hide the superuser
-    return render(request, 'dashboard/manage_users.html', {'users': users})
+    page = keyset_paginate(users, request.GET.get('cursor'), page_size_from(request),
+                           key=('date_joined', 'id'))
+    return _paginated(request, 'dashboard/manage_users.html', 'dashboard/_user_rows.html', {
+        'users': page, 'page': page,
+    })
 
 
 @user_passes_test(lambda u: u.is_superuser)
@@ -391,9 +619,3 @@ def make_superuser(request, user_id):
     else:
         messages.error(request, "You do not have permission to do that.")
     return redirect('dashboard-home')
-
-def cart_count(request):
-    
-    cart =request.session.get('cart', {})
-    total_quantity = sum(cart.values())
-    return {'cart_quantity': total_quantity}